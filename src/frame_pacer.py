@@ -0,0 +1,50 @@
+# Licensed under GPL3 https://github.com/maoschanz/drawing/blob/master/LICENSE
+
+import time
+
+################################################################################
+
+class DrFramePacer():
+	"""Measures how long the active tool takes to render its preview, and how
+	long the canvas takes to be drawn, to deduce how long the image should
+	wait before rendering the next preview. The rendering can use only a part
+	of the time, so the motion events are still handled: the previews on small
+	images are shown at 60 fps, and huge images stay responsive."""
+	__gtype_name__ = 'DrFramePacer'
+
+	# Limits of the interval between two previews, in milliseconds
+	MIN_INTERVAL = 16
+	MAX_INTERVAL = 500
+	# Part of the time the rendering is allowed to use
+	RENDERING_SHARE = 0.5
+	# Weight of the latest measure in the averages
+	SMOOTHING = 0.25
+
+	def __init__(self, **kwargs):
+		self._preview_cost = 0.0
+		self._draw_cost = 0.0
+
+	def start(self):
+		"""Return the time to give to `add_preview_cost` or `add_draw_cost`
+		when what is measured ends."""
+		return time.perf_counter()
+
+	def add_preview_cost(self, start_time):
+		self._preview_cost = self._average(self._preview_cost, start_time)
+
+	def add_draw_cost(self, start_time):
+		self._draw_cost = self._average(self._draw_cost, start_time)
+
+	def get_interval(self):
+		"""Return how long to wait before rendering the next preview, in
+		milliseconds."""
+		cost = (self._preview_cost + self._draw_cost) / self.RENDERING_SHARE
+		return int(max(self.MIN_INTERVAL, min(self.MAX_INTERVAL, cost)))
+
+	def _average(self, average, start_time):
+		duration = (time.perf_counter() - start_time) * 1000
+		return average + self.SMOOTHING * (duration - average)
+
+	############################################################################
+################################################################################
+
@@ -0,0 +1,72 @@
+# Licensed under GPL3 https://github.com/maoschanz/drawing/blob/master/LICENSE
+
+import collections, time
+
+################################################################################
+
+class DrFrameProfiler():
+	"""Development only: measures the duration of each phase of the frames
+	rendered while a tool is used, and summarizes the recent measures with
+	percentiles. Each measure can also be written in a log file."""
+	__gtype_name__ = 'DrFrameProfiler'
+
+	PHASES = ['restore', 'operation', 'paint', 'overlay', 'outline']
+	# Number of recent measures of each phase used for the percentiles
+	MAX_SAMPLES = 300
+
+	def __init__(self, log_path=None, **kwargs):
+		self._samples = {}
+		self._totals = {}
+		for phase in self.PHASES:
+			self._samples[phase] = collections.deque(maxlen=self.MAX_SAMPLES)
+			self._totals[phase] = 0.0
+		if log_path is None:
+			self._log_file = None
+		else:
+			self._log_file = open(log_path, 'a', buffering=1)
+
+	def start(self):
+		"""Return the time to give to `add` when the phase ends."""
+		return time.perf_counter()
+
+	def add(self, phase, start_time, excluded=0.0):
+		"""Record the duration of a phase which began at `start_time`, minus
+		the `excluded` milliseconds spent in other phases meanwhile. Return
+		the time when the phase ended, which the next phase can use."""
+		end_time = time.perf_counter()
+		duration = (end_time - start_time) * 1000 - excluded
+		self._samples[phase].append(duration)
+		self._totals[phase] += duration
+		if self._log_file is not None:
+			self._log_file.write("{0:.3f}\t{1}\t{2:.3f}\n".format(time.time(), \
+			                                                   phase, duration))
+		return end_time
+
+	def get_total(self, phase):
+		"""Return the milliseconds spent in this phase since the beginning."""
+		return self._totals[phase]
+
+	def get_summary(self):
+		"""Return the 50th, 90th and 99th percentiles of the recent durations
+		of each phase, as a string."""
+		summaries = []
+		for phase in self.PHASES:
+			samples = sorted(self._samples[phase])
+			if len(samples) == 0:
+				continue
+			percentiles = [samples[min(len(samples) - 1, int(len(samples) * q))] \
+			                                             for q in (0.5, 0.9, 0.99)]
+			summaries.append("{0} {1:.1f}/{2:.1f}/{3:.1f}".format(phase, \
+			                                                     *percentiles))
+		if len(summaries) == 0:
+			return "No frame measured yet"
+		return "p50/p90/p99 (ms): " + ", ".join(summaries)
+
+	def close(self):
+		if self._log_file is not None:
+			self._log_file.close()
+			self._log_file = None
+
+	############################################################################
+################################################################################
+
@@ -0,0 +1,370 @@
+# Licensed under GPL3 https://github.com/maoschanz/drawing/blob/master/LICENSE
+
+import fcntl, json, os, queue, struct, threading, time, uuid, zlib
+from gi.repository import GLib
+from .utilities_history import utilities_operation_to_bytes, \
+                               utilities_operation_from_bytes
+
+################################################################################
+
+class DrHistoryJournal():
+	"""Append-only file where a history writes its events (operations, states,
+	undo, redo, ...) so it can be restored after a crash, or when the image is
+	opened again. Each journal has a small JSON file with its metadata, such as
+	the path of the image and its modification time.
+
+	The events are serialized, compressed and written by a thread, so the big
+	pixbufs of the states don't block the window. Each event is identified by
+	its index, which `compact` uses to rewrite the journal with only some of
+	them.
+
+	The journal is locked while a history uses it, so other processes (or other
+	tabs) can find the journals which have been left behind."""
+	__gtype_name__ = 'DrHistoryJournal'
+
+	# Journals of images closed normally are forgotten after this delay
+	MAX_AGE = 7 * 24 * 3600
+	# Total size of the journals above which the oldest unused ones are deleted
+	MAX_DIRECTORY_SIZE = 512 * 1048576
+
+	# Journals left for each image file, by the path of the file, so they're
+	# found without opening all the journals each time a file is opened
+	_orphans_by_file_path = None
+
+	def __init__(self, path, **kwargs):
+		"""Open and lock the journal at the given path (without extension).
+		Raises an OSError if it's already used."""
+		self._path = path
+		self._file = open(path + '.journal', 'ab+')
+		try:
+			fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+			if os.fstat(self._file.fileno()).st_ino \
+			                         != os.stat(path + '.journal').st_ino:
+				# The file has been replaced by `compact` meanwhile
+				raise OSError("The journal has been replaced")
+		except OSError:
+			self._file.close()
+			raise
+		try:
+			with open(path + '.json', 'r') as metadata_file:
+				self._metadata = json.load(metadata_file)
+		except (OSError, ValueError):
+			self._metadata = {}
+
+		# Position and length in the file of each event, by index. It's only
+		# used by the thread once it has started.
+		self._events = {}
+		self._nb_events = 0
+		self._size = 0
+		self._queue = queue.Queue()
+		self._thread = None
+		self._error = None
+
+	@staticmethod
+	def get_directory():
+		directory = os.path.join(GLib.get_user_cache_dir(), 'drawing', 'journals')
+		os.makedirs(directory, exist_ok=True)
+		return directory
+
+	@classmethod
+	def new(cls):
+		path = os.path.join(cls.get_directory(), uuid.uuid4().hex)
+		journal = cls(path)
+		journal.set_metadata(path=None, mtime=None, closed=False)
+		return journal
+
+	@classmethod
+	def get_orphans(cls):
+		"""Return the journals which aren't used by any history, and delete the
+		ones which are too old to be useful, or the oldest ones if all the
+		journals together are too big."""
+		orphans = []
+		total_size = 0
+		directory = cls.get_directory()
+		for file_name in os.listdir(directory):
+			if not file_name.endswith('.journal'):
+				continue
+			path = os.path.join(directory, file_name[:-len('.journal')])
+			try:
+				total_size += os.path.getsize(path + '.journal')
+				journal = cls(path)
+			except OSError:
+				continue
+			if journal.is_outdated():
+				total_size -= journal.get_file_size()
+				journal.close(delete=True)
+			else:
+				orphans.append(journal)
+
+		# The journals of closed images are deleted first, since they're less
+		# likely to be needed than the ones left by a crash
+		by_priority = sorted(orphans, key=lambda journal: \
+		                        (not journal.get_metadata('closed'), \
+		                         journal.get_metadata('updated') or 0))
+		for journal in by_priority:
+			if total_size <= cls.MAX_DIRECTORY_SIZE:
+				break
+			total_size -= journal.get_file_size()
+			journal.close(delete=True)
+			orphans.remove(journal)
+		return orphans
+
+	@classmethod
+	def find_orphan(cls, file_path):
+		"""Return the journal left for the image at this path, if it still
+		corresponds to the file on the disk."""
+		if cls._orphans_by_file_path is None:
+			cls._index_orphans()
+		path = cls._orphans_by_file_path.pop(file_path, None)
+		if path is None or not os.path.exists(path + '.journal'):
+			return None
+		try:
+			journal = cls(path)
+		except OSError:
+			# It's used by an other history
+			return None
+		if journal.is_outdated():
+			journal.close(delete=True)
+			return None
+		if journal.get_metadata('path') != file_path:
+			journal.close()
+			return None
+		return journal
+
+	@classmethod
+	def _index_orphans(cls):
+		"""Find the most recent journal of each file, only from the metadata,
+		so the journals don't have to be opened."""
+		cls._orphans_by_file_path = {}
+		updated = {}
+		directory = cls.get_directory()
+		for file_name in os.listdir(directory):
+			if not file_name.endswith('.journal'):
+				continue
+			path = os.path.join(directory, file_name[:-len('.journal')])
+			try:
+				with open(path + '.json', 'r') as metadata_file:
+					metadata = json.load(metadata_file)
+			except (OSError, ValueError):
+				continue
+			file_path = metadata.get('path', None)
+			if file_path is None:
+				continue
+			if metadata.get('updated', 0) >= updated.get(file_path, 0):
+				cls._orphans_by_file_path[file_path] = path
+				updated[file_path] = metadata.get('updated', 0)
+
+	@classmethod
+	def trim_directory(cls):
+		"""Delete the unused journals which are outdated, or too big. They're
+		opened only if the journals together are too big."""
+		directory = cls.get_directory()
+		total_size = 0
+		for entry in os.scandir(directory):
+			if entry.name.endswith('.journal'):
+				total_size += entry.stat().st_size
+		if total_size <= cls.MAX_DIRECTORY_SIZE:
+			return
+		for journal in cls.get_orphans():
+			journal.close()
+
+	def get_file_size(self):
+		return os.fstat(self._file.fileno()).st_size
+
+	############################################################################
+	# Metadata #################################################################
+
+	def get_metadata(self, key):
+		return self._metadata.get(key, None)
+
+	def set_metadata(self, **kwargs):
+		self._metadata.update(kwargs)
+		self._metadata['updated'] = time.time()
+		GLib.file_set_contents(self._path + '.json', \
+		                              json.dumps(self._metadata).encode('utf-8'))
+
+	def set_file_path(self, file_path):
+		if file_path is None:
+			self.set_metadata(path=None, mtime=None)
+		else:
+			self.set_metadata(path=file_path, mtime=os.path.getmtime(file_path))
+
+	def is_outdated(self):
+		file_path = self.get_metadata('path')
+		if file_path is not None:
+			if not os.path.exists(file_path):
+				return True
+			if os.path.getmtime(file_path) != self.get_metadata('mtime'):
+				# The file has been modified since: its history is meaningless
+				return True
+		if self.get_metadata('closed'):
+			updated = self.get_metadata('updated') or 0
+			return time.time() - updated > self.MAX_AGE
+		return False
+
+	############################################################################
+	# Events ###################################################################
+
+	def write_event(self, event):
+		"""Queue an event (a dict) to be appended to the journal, and return its
+		index. Raises the TypeError or OSError which made the thread fail to
+		write a previous event, since the journal is incomplete then. The event
+		must not be modified afterwards."""
+		self._raise_error()
+		index = self._nb_events
+		self._nb_events += 1
+		self._put_task('event', (index, event))
+		return index
+
+	def compact(self, indexes, nb_undone):
+		"""Rewrite the journal with only the events at the given indexes, in
+		this order, followed by `nb_undone` 'undo' events. The indexes of the
+		kept events don't change."""
+		self._raise_error()
+		self._put_task('compact', (list(indexes), nb_undone))
+
+	def read_events(self):
+		"""Return the list of all the events written in the journal, whose
+		indexes are their positions in the list. If the process crashed while
+		writing the last one, it's ignored."""
+		self._queue.join()
+		events = []
+		self._events = {}
+		valid_length = 0
+		self._file.seek(0)
+		while True:
+			header = self._file.read(4)
+			if len(header) < 4:
+				break
+			length = struct.unpack('>I', header)[0]
+			data = self._file.read(length)
+			if len(data) < length:
+				break
+			try:
+				events.append(utilities_operation_from_bytes(zlib.decompress(data)))
+			except Exception:
+				break
+			self._events[len(events) - 1] = (valid_length, 4 + length)
+			valid_length += 4 + length
+		# Remove the incomplete event, so new events can be appended after the
+		# valid ones
+		self._file.truncate(valid_length)
+		self._file.seek(0, os.SEEK_END)
+		self._size = valid_length
+		self._nb_events = len(events)
+		return events
+
+	def flush(self):
+		"""Wait until the queued events are written."""
+		self._queue.join()
+
+	def close(self, delete=False):
+		"""Write the queued events, then unlock and close the journal (if it's
+		not already closed), and optionally delete its files."""
+		if self._thread is not None:
+			self._queue.put(None)
+			self._thread.join()
+			self._thread = None
+		if delete:
+			for extension in ['.journal', '.json']:
+				if os.path.exists(self._path + extension):
+					os.remove(self._path + extension)
+		self._update_orphans_index(delete)
+		if self._file.closed:
+			return
+		fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+		self._file.close()
+
+	def _update_orphans_index(self, is_deleted):
+		orphans = DrHistoryJournal._orphans_by_file_path
+		file_path = self.get_metadata('path')
+		if orphans is None or file_path is None:
+			return
+		if not is_deleted:
+			orphans[file_path] = self._path
+		elif orphans.get(file_path, None) == self._path:
+			del orphans[file_path]
+
+	############################################################################
+	# Writing thread ###########################################################
+
+	def _put_task(self, task_type, values):
+		if self._file.closed:
+			raise OSError("The journal is closed")
+		if self._thread is None:
+			self._thread = threading.Thread(target=self._run, \
+			                         name='drawing-journal', daemon=True)
+			self._thread.start()
+		self._queue.put((task_type, values))
+
+	def _raise_error(self):
+		if self._error is not None:
+			raise self._error
+
+	def _run(self):
+		while True:
+			task = self._queue.get()
+			try:
+				if task is None:
+					return
+				if self._error is not None:
+					# An event is missing, the next ones would be meaningless
+					continue
+				task_type, values = task
+				if task_type == 'event':
+					self._append(*values)
+				else:
+					self._compact(*values)
+			except Exception as e:
+				self._error = e
+			finally:
+				self._queue.task_done()
+
+	def _append(self, index, event):
+		data = self._pack(event)
+		self._file.seek(0, os.SEEK_END)
+		self._file.write(data)
+		self._file.flush()
+		self._events[index] = (self._size, len(data))
+		self._size += len(data)
+
+	def _pack(self, event):
+		data = zlib.compress(utilities_operation_to_bytes(event), 1)
+		return struct.pack('>I', len(data)) + data
+
+	def _compact(self, indexes, nb_undone):
+		# The new file is locked before it replaces the old one, so no other
+		# process can take it as an orphan
+		new_file = open(self._path + '.journal.tmp', 'wb+')
+		try:
+			fcntl.flock(new_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+			events = {}
+			size = 0
+			for index in indexes:
+				offset, length = self._events[index]
+				self._file.seek(offset)
+				new_file.write(self._file.read(length))
+				events[index] = (size, length)
+				size += length
+			undo_data = self._pack({'type': 'undo'})
+			for i in range(0, nb_undone):
+				new_file.write(undo_data)
+				size += len(undo_data)
+			new_file.flush()
+			os.fsync(new_file.fileno())
+			os.replace(self._path + '.journal.tmp', self._path + '.journal')
+		except Exception:
+			new_file.close()
+			if os.path.exists(self._path + '.journal.tmp'):
+				os.remove(self._path + '.journal.tmp')
+			raise
+		fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+		self._file.close()
+		self._file = new_file
+		self._file.seek(0, os.SEEK_END)
+		self._events = events
+		self._size = size
+
+	############################################################################
+################################################################################
+
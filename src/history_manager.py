@@ -1,20 +1,92 @@
 # Licensed under GPL3 https://github.com/maoschanz/drawing/blob/master/LICENSE
 
+import sys, time, weakref, zlib
 from gi.repository import Gdk, Gio, GdkPixbuf, GLib
+from .history_journal import DrHistoryJournal
+from .history_spill import DrHistorySpill
+from .utilities_history import utilities_operation_to_bytes, \
+                               utilities_operation_from_bytes, \
+                               utilities_get_operation_size
 # from .abstract_tool import WrongToolIdException
 
 ################################################################################
 
+class DrHistoryRecord():
+	"""Entry of the history. Its `operation` is the dict built by a tool, or a
+	dict describing a state (whose 'tool_id' is None). Everything the history
+	manager needs to know about the entry is stored in the slots, so the dict
+	is only read when the entry is replayed or restored."""
+	__slots__ = ('tool_id', 'operation', 'is_keyframe', 'replay_cost', \
+	   'undo_patch', 'compressed', 'spill_handle', 'size', 'journal_index')
+
+	def __init__(self, operation, is_keyframe=False):
+		self.tool_id = operation['tool_id']
+		self.operation = operation
+		self.is_keyframe = is_keyframe
+		self.replay_cost = 0
+		self.undo_patch = None
+		self.compressed = None
+		self.spill_handle = None
+		self.size = None
+		# Index of the event of the journal which added the record
+		self.journal_index = None
+
+	def is_state(self):
+		return self.tool_id is None
+
+################################################################################
+
 class DrHistoryManager():
 	__gtype_name__ = 'DrHistoryManager'
 
+	# Histories of all the opened images, to enforce the global memory budget
+	_all_histories = weakref.WeakSet()
+	# Estimated number of bytes used by all of them together
+	_global_usage = 0
+
+	# Spill file shared by all histories, created when needed
+	_spill = None
+	_spill_failed = False
+	SPILL_MIN_SIZE = 4096
+
+	# Duration (in seconds) of the batches of operations replayed by a rebuild
+	# before giving the control back to the main loop
+	REPLAY_STEP_DURATION = 0.03
+
+	# Keyframes are written in the journal only when the operations journaled
+	# since the last state exceed this many times the limits of the keyframes:
+	# a rebuild after a crash can be slower than an undo, but the journal grows
+	# way slower.
+	JOURNAL_KEYFRAME_FACTOR = 4
+
 	def __init__(self, image, **kwargs):
 		self._image = image
+		self._initial_state = None
+		DrHistoryManager._all_histories.add(self)
+		# Sum of the sizes of the entries, updated each time an entry is added,
+		# deleted, or changes, so the budgets are checked without a scan
+		self._memory_usage = 0
 
 		self._undo_history = []
 		self._redo_history = []
+		# Indexes of the states in the undo-history, in ascending order
+		self._state_indexes = []
 		self._is_saved = True
+		# True from the moment a rebuild is requested until the replay is over:
+		# meanwhile, the main pixbuf doesn't correspond to the history
 		self._waiting_for_rebuild = False
+		self._is_rebuilding = False
+		self._rebuild_timeout_id = None
+		# Operations the rebuild is replaying, and the index of the next one
+		self._replay_queue = None
+		self._replay_index = 0
+		self._replay_source_id = None
+		self._journal = None
+
+		# Number of operations since the last state of the undo-history, and
+		# the estimated time (in milliseconds) required to replay them
+		self._tail_length = 0
+		self._tail_cost = 0
 
 	def get_saved(self):
 		# XXX undoing/redoing doesn't update the title so the "*" isn't visible
@@ -22,19 +94,32 @@ class DrHistoryManager():
 		return self._is_saved
 
 	def empty_history(self):
-		"""Probably useless way to explicitly 'forget' the objects. It doesn't
-		really free the memory, but it kinda helps i suppose."""
-		for op in self._undo_history:
-			self._delete_operation(op)
-		for op in self._redo_history:
-			self._delete_operation(op)
-		self._delete_operation(self.initial_operation)
-
-	def _delete_operation(self, op):
-		for key in op:
-			op[key] = None
-		op = {}
-		op = None
+		"""Forget the entries of the history, when it's not used anymore."""
+		self._delete_all_records()
+		DrHistoryManager._all_histories.discard(self)
+
+	def _delete_all_records(self):
+		"""Forget all the entries, including the ones waiting to be replayed,
+		and release what they use in the spill file."""
+		if self._rebuild_timeout_id is not None:
+			GLib.source_remove(self._rebuild_timeout_id)
+			self._rebuild_timeout_id = None
+		self._cancel_replay()
+		for record in self._get_all_records():
+			self._delete_record(record)
+		self._undo_history = []
+		self._redo_history = []
+		self._initial_state = None
+
+	def _delete_record(self, record):
+		if record.spill_handle is not None:
+			DrHistoryManager._spill.release(record.spill_handle)
+		record.operation = None
+		record.undo_patch = None
+		record.compressed = None
+		record.spill_handle = None
+		self._add_usage(-(record.size or 0))
+		record.size = 0
 
 	############################################################################
 	# Controls accessed by DrImage #############################################
@@ -43,19 +128,37 @@ class DrHistoryManager():
 		if self._operation_is_ongoing():
 			self._image.active_tool().cancel_ongoing_operation()
 			return
+		self._cancel_replay()
+		self._pop_keyframes()
 		if len(self._undo_history) > 0:
-			last_op = self._undo_history.pop()
-			self._redo_history.append(last_op)
+			last_record = self._pop_undo()
+			self._redo_history.append(last_record)
+			self._write_journal('undo')
+			if self._try_undo_patch(last_record):
+				self._image.update_history_sensitivity()
+				return
 		self._rebuild_from_history_async()
 		self._image.update_history_sensitivity()
 
 	def try_redo(self, *args):
-		operation = self._redo_history.pop()
-		if operation['tool_id'] is None:
-			self._undo_history.append(operation)
+		self._cancel_replay()
+		record = self._load_record(self._redo_history.pop())
+		self._write_journal('redo')
+		if record.is_state():
+			self._push_undo(record)
 			self._image.restore_last_state()
+			# The image corresponds to the history again
+			self._stop_rebuild()
+		elif self._waiting_for_rebuild:
+			# Applying the operation on an incomplete image would be pointless,
+			# the rebuild will replay it
+			self.add_operation(record.operation, record.replay_cost)
+			self._delete_record(record)
 		else:
-			self._get_tool(operation['tool_id']).apply_operation(operation)
+			operation = record.operation
+			self._get_tool(record.tool_id).apply_operation(operation)
+			# The operation is in a new entry now
+			self._delete_record(record)
 
 	def can_undo(self):
 		# XXX incorrect si ya des states et qu'on redo
@@ -79,30 +182,70 @@ class DrHistoryManager():
 #			# XXX pointless: the method is called after applying the operation
 #			undo_label = self._image.active_tool().tool_id
 #		elif len(undoable_action) > 0:
-#			undo_label = undoable_action[0]['tool_id']
+#			undo_label = undoable_action[0].tool_id
 #		if len(redoable_action) > 0:
-#			redo_label = redoable_action[0]['tool_id']
+#			redo_label = redoable_action[0].tool_id
 #		self._image.window.update_history_actions_labels(undo_label, redo_label)
 
 	def rewind_history(self):
 		"""Put the entire 'undo' history into the 'redo' history, so the image
 		can be reset without losing any data."""
-		self._redo_history = self._undo_history[::-1] + self._redo_history
+		self._stop_rebuild()
+		# The keyframes can't be redone, they would be useless presses
+		for record in self._undo_history:
+			if record.is_keyframe:
+				self._delete_record(record)
+		self._redo_history = [record for record in self._undo_history[::-1] \
+		                       if not record.is_keyframe] + self._redo_history
 		self._undo_history = []
+		self._state_indexes = []
+		self._write_journal('rewind')
 		self._image.update_history_sensitivity()
 
 	############################################################################
 	# Serialized operations ####################################################
 
-	def add_operation(self, operation):
-		self._image.set_surface_as_stable_pixbuf()
+	def add_operation(self, operation, replay_cost=0, undo_patch=None):
 		# print('add_operation_to_history')
 		# print(operation['tool_id'])
 		# if 'select' in operation['tool_id']:
 		# 	print(operation['operation_type'])
 		# 	print('-----------------------------------')
 		self._is_saved = False
-		self._undo_history.append(operation)
+		if not self._is_rebuilding:
+			self._cancel_replay()
+		record = DrHistoryRecord(operation)
+		record.replay_cost = replay_cost
+		record.undo_patch = undo_patch
+		self._count_record(record)
+		self._push_undo(record)
+		record.journal_index = self._write_journal('operation', \
+		                                  operation=operation, cost=replay_cost)
+		self._tail_length += 1
+		self._tail_cost += replay_cost
+		if self._waiting_for_rebuild and not self._is_rebuilding:
+			# The operation has been applied to an image which doesn't
+			# correspond to the history yet, so it can't be used as a keyframe:
+			# rebuild it right now instead.
+			self._rebuild_from_history()
+			self._enforce_memory_budgets()
+		elif not self._try_add_keyframe():
+			self._enforce_memory_budgets()
+
+	def _push_undo(self, record):
+		if record.is_state():
+			self._state_indexes.append(len(self._undo_history))
+		self._undo_history.append(record)
+
+	def _pop_undo(self):
+		record = self._undo_history.pop()
+		if record.is_state():
+			self._state_indexes.pop()
+		return record
+
+	def _reindex_states(self):
+		self._state_indexes = [index for index, record \
+		                  in enumerate(self._undo_history) if record.is_state()]
 
 	############################################################################
 	# Cached pixbufs ###########################################################
@@ -112,89 +255,720 @@ class DrHistoryManager():
 		g = float(rgba_array[1])
 		b = float(rgba_array[2])
 		a = float(rgba_array[3])
-		self.initial_operation = {
+		if self._initial_state is not None:
+			self._delete_record(self._initial_state)
+		self._initial_state = DrHistoryRecord({
 			'tool_id': None,
 			'pixbuf': pixbuf,
 			'rgba': Gdk.RGBA(red=r, green=g, blue=b, alpha=a),
 			'width': width, 'height': height
-		}
+		})
+		self._count_record(self._initial_state)
+		if self._journal is None:
+			self._start_journal()
+		self._set_journal_file_path()
+		self._initial_state.journal_index = self._write_journal('initial', \
+		                                   operation=self._initial_state.operation)
+		self._enforce_memory_budgets()
 
 	def add_state(self, pixbuf):
 		if pixbuf is None:
 			# Context: an error message
 			raise Exception(_("Attempt to save an invalid state"))
-		self._undo_history.append({
+		# The pixbuf of the new state is what the image is now, whatever the
+		# history contains before it
+		self._stop_rebuild()
+		record = self._new_state_record(pixbuf, False)
+		self._push_undo(record)
+		record.journal_index = self._write_journal('state', \
+		                              operation=record.operation, keyframe=False)
+		self._reset_tail()
+		self._is_saved = True
+		self._enforce_memory_budgets()
+		self._compact_journal()
+
+	def _new_state_record(self, pixbuf, is_keyframe):
+		record = DrHistoryRecord({
 			'tool_id': None,
 			'pixbuf': pixbuf,
 			'width': pixbuf.get_width(),
 			'height': pixbuf.get_height()
-		})
-		self._is_saved = True
+		}, is_keyframe)
+		self._count_record(record)
+		return record
 
 	def has_initial_pixbuf(self):
-		return self.initial_operation['pixbuf'] is not None
+		# a blank initial state is too small to be compressed or spilled
+		initial_state = self._initial_state
+		return initial_state.compressed is not None \
+		                       or initial_state.spill_handle is not None \
+		                       or initial_state.operation['pixbuf'] is not None
+
+	def get_initial_state(self):
+		return self._initial_state
+
+	def get_initial_rgba(self):
+		return self._load_record(self._initial_state).operation['rgba']
 
 	def get_last_saved_state(self):
-		index = self._get_last_state_index(False)
+		index = self._get_last_state_index()
 		if index == -1:
-			return self.initial_operation
+			record = self._initial_state
 		else:
-			return self._undo_history[index]
+			record = self._undo_history[index]
+		# The last state is likely to be restored several times in a row
+		self._load_record(record)
+		self._decompress_state(record)
+		return record
+
+	def get_state_pixbuf(self, record):
+		"""Return the pixbuf of a state, which may be compressed or spilled.
+		The returned pixbuf must not be modified."""
+		self._load_record(record)
+		if record.compressed is None:
+			return record.operation['pixbuf']
+		return self._get_decompressed_pixbuf(record)
+
+	def _get_last_state_index(self):
+		"""Return the index of the last "state" record in the undo-history. If
+		there is no such record, the returned index is -1 which means the only
+		known state is the initial state."""
+		# If there are too many pixbufs in the history, the old ones are
+		# compressed or forgotten by `_enforce_memory_budgets` (issue #200)
+		if len(self._state_indexes) == 0:
+			return -1
+		return self._state_indexes[-1]
 
-	def _get_last_state_index(self, allow_yeeting_states):
-		"""Return the index of the last "state" operation (dict whose 'tool_id'
-		value is None) in the undo-history. If there is no such operation, the
-		returned index is -1 which means the only known state is the
-		self.initial_operation attribute."""
+	############################################################################
+	# Automatic states (keyframes) #############################################
+
+	def _try_add_keyframe(self):
+		"""Remember the current pixbuf as an automatic state (a "keyframe") if
+		too many operations, or operations too slow to replay, have been added
+		since the last state. This bounds what `_rebuild_from_history` has to
+		replay when the user undoes something."""
+		max_length, max_cost = self._image.get_keyframe_limits()
+		length_exceeded = max_length > 0 and self._tail_length >= max_length
+		cost_exceeded = max_cost > 0 and self._tail_cost >= max_cost
+		if not length_exceeded and not cost_exceeded:
+			return False
+		if self._image.selection.is_active:
+			# Restoring a state resets the selection, which would be lost
+			return False
+		record = self._new_state_record(self._image.get_main_pixbuf().copy(), True)
+		self._push_undo(record)
+		if self._journal_needs_keyframe(max_length, max_cost):
+			record.journal_index = self._write_journal('state', \
+			                           operation=record.operation, keyframe=True)
+		self._reset_tail()
+		self._enforce_memory_budgets()
+		return True
+
+	def _journal_needs_keyframe(self, max_length, max_cost):
+		"""Tell if the operations written in the journal since its last state
+		would be too long to replay after a crash."""
+		length = 0
+		cost = 0
+		for record in reversed(self._undo_history[:-1]):
+			if record.is_state() and record.journal_index is not None:
+				break
+			if not record.is_state():
+				length += 1
+				cost += record.replay_cost
+		factor = self.JOURNAL_KEYFRAME_FACTOR
+		return (max_length > 0 and length >= max_length * factor) \
+		                       or (max_cost > 0 and cost >= max_cost * factor)
+
+	def _pop_keyframes(self):
+		"""Forget the keyframes at the end of the undo-history: the user can't
+		undo them, and the operation about to be undone makes them outdated."""
+		while len(self._undo_history) > 0 and self._undo_history[-1].is_keyframe:
+			self._delete_record(self._pop_undo())
+
+	def _reset_tail(self):
+		self._tail_length = 0
+		self._tail_cost = 0
+
+	def _recount_tail(self):
+		tail = self._undo_history[self._get_last_state_index() + 1:]
+		self._tail_length = len(tail)
+		self._tail_cost = sum(record.replay_cost for record in tail)
 
-		returned_index = -1
-		nbPixbufs = 0
-		for op in self._undo_history:
-			if op['tool_id'] is None:
-				last_saved_pixbuf_op = op
-				returned_index = self._undo_history.index(op)
-				nbPixbufs += 1
+	############################################################################
+	# Undo patches #############################################################
+
+	def _try_undo_patch(self, record):
+		"""Undo the operation by pasting back the pixels it modified, which is
+		way faster than rebuilding the image from the history. Return whether
+		it was possible."""
+		if self._waiting_for_rebuild:
+			# The main pixbuf doesn't correspond to the history yet
+			return False
+		if self._image.selection.is_active:
+			return False
+		self._load_record(record)
+		if record.undo_patch is None:
+			return False
+		if not self._image.apply_pixbuf_patch(*record.undo_patch):
+			return False
+		# The patch will be captured again if the operation is redone
+		record.undo_patch = None
+		self._update_record_size(record)
+		self._recount_tail()
+		return True
 
-		# TODO if there are too many pixbufs in the history, remove a few ones
-		# Issue #200, needs more design because saving can change the data
+	############################################################################
+	# Memory budgets ###########################################################
+
+	def get_memory_usage(self):
+		"""Return the estimated number of bytes used by the entries of the
+		history (the spilled ones don't count)."""
+		return self._memory_usage
+
+	def _add_usage(self, delta):
+		self._memory_usage += delta
+		DrHistoryManager._global_usage += delta
+
+	def _count_record(self, record):
+		"""Add the size of a new entry to the usage."""
+		self._add_usage(self._get_record_size(record))
+
+	def _update_record_size(self, record):
+		"""Estimate again the size of an entry whose content changed."""
+		self._add_usage(-(record.size or 0))
+		record.size = None
+		self._add_usage(self._get_record_size(record))
+
+	def _get_all_records(self):
+		"""Return the entries of the history, from the oldest to the newest."""
+		records = self._undo_history + self._redo_history[::-1]
+		if self._initial_state is not None:
+			records.insert(0, self._initial_state)
+		return records
+
+	def _get_record_size(self, record):
+		# The size is cached in the record since it can be slow to estimate
+		if record.size is None:
+			record.size = sys.getsizeof(record) + utilities_get_operation_size( \
+			         [record.operation, record.undo_patch, record.compressed])
+		return record.size
+
+	def _enforce_memory_budgets(self):
+		"""Shrink the history of this image if it exceeds its own budget, then
+		shrink the histories of all opened images (the biggest first) if they
+		exceed the global budget together."""
+		image_budget, global_budget = self._image.get_history_budgets()
+		if image_budget > 0 and self._memory_usage > image_budget:
+			self._shrink(self._memory_usage - image_budget)
+		if global_budget <= 0 or DrHistoryManager._global_usage <= global_budget:
+			return
+		excess = DrHistoryManager._global_usage - global_budget
+		histories = sorted(DrHistoryManager._all_histories, \
+		                   key=lambda history: history._memory_usage, reverse=True)
+		for history in histories:
+			if excess <= 0:
+				return
+			excess -= history._shrink(excess)
+
+	def _shrink(self, bytes_to_free):
+		"""Free memory by forgetting keyframes, then by moving the oldest
+		entries to the spill file, or by compressing the oldest states if
+		spilling isn't possible. The last state of the undo-history, and the
+		operations after it, are never affected, since `_rebuild_from_history`
+		uses them. Return the number of bytes actually freed."""
+		freed = 0
+		if bytes_to_free <= 0:
+			return freed
+		last_state = self.get_last_saved_state()
+
+		# Keyframes aren't required: the rebuild will just replay more
+		# operations, from an older state.
+		keyframes = [record for record in self._undo_history \
+		                   if record.is_keyframe and record is not last_state]
+		removed_ids = set()
+		for record in keyframes:
+			if freed >= bytes_to_free:
+				break
+			freed += self._get_record_size(record)
+			removed_ids.add(id(record))
+			self._delete_record(record)
+		if len(removed_ids) > 0:
+			self._undo_history = [record for record in self._undo_history \
+			                                  if id(record) not in removed_ids]
+			self._reindex_states()
+		if freed >= bytes_to_free:
+			return freed
+
+		last_index = self._get_last_state_index()
+		protected = [last_state] + self._undo_history[last_index + 1:]
+		protected_ids = {id(record) for record in protected}
+		records = [record for record in self._get_all_records() \
+		                                  if id(record) not in protected_ids]
+
+		if self._image.should_spill_history():
+			for record in records:
+				if freed >= bytes_to_free:
+					return freed
+				freed += self._spill_record(record)
+
+		# States created by saving, or by loading the image, can't be rebuilt
+		# from the operations around them, but they can be compressed.
+		for record in records:
+			if freed >= bytes_to_free:
+				return freed
+			if not record.is_state() or record.operation is None \
+			or record.operation['pixbuf'] is None:
+				continue
+			freed += self._get_record_size(record)
+			self._compress_state(record)
+			freed -= self._get_record_size(record)
+		return freed
+
+	def _compress_state(self, record):
+		pixbuf = record.operation['pixbuf']
+		pixels = pixbuf.read_pixel_bytes().get_data()
+		record.compressed = {
+			'data': zlib.compress(pixels, 1),
+			'has_alpha': pixbuf.get_has_alpha(),
+			'rowstride': pixbuf.get_rowstride()
+		}
+		record.operation['pixbuf'] = None
+		self._update_record_size(record)
 
-		# print("returned_index : " + str(returned_index))
-		return returned_index
+	def _decompress_state(self, record):
+		if record.compressed is None:
+			return
+		record.operation['pixbuf'] = self._get_decompressed_pixbuf(record)
+		record.compressed = None
+		self._update_record_size(record)
+
+	def _get_decompressed_pixbuf(self, record):
+		compressed = record.compressed
+		pixels = GLib.Bytes.new(zlib.decompress(compressed['data']))
+		return GdkPixbuf.Pixbuf.new_from_bytes(pixels, \
+		              GdkPixbuf.Colorspace.RGB, compressed['has_alpha'], 8, \
+		              record.operation['width'], record.operation['height'], \
+		              compressed['rowstride'])
 
 	############################################################################
-	# Other private methods ####################################################
+	# Spill file ###############################################################
+
+	def _spill_record(self, record):
+		"""Move the content of a record to the spill file, and keep only its
+		slots in memory. Return the number of bytes freed."""
+		if record.spill_handle is not None or DrHistoryManager._spill_failed:
+			return 0
+		size = self._get_record_size(record)
+		if size < self.SPILL_MIN_SIZE:
+			return 0
+		try:
+			data = utilities_operation_to_bytes({
+				'operation': record.operation,
+				'undo_patch': record.undo_patch,
+				'compressed': record.compressed
+			})
+			record.spill_handle = self._get_spill().write(data)
+		except TypeError:
+			# This operation has values that can't be serialized
+			return 0
+		except OSError as e:
+			self._image.window.reveal_action_report(str(e))
+			DrHistoryManager._spill_failed = True
+			return 0
+		record.operation = None
+		record.undo_patch = None
+		record.compressed = None
+		self._update_record_size(record)
+		return size - self._get_record_size(record)
+
+	def _load_record(self, record):
+		"""Restore the content of a record moved to the spill file."""
+		if record.spill_handle is None:
+			return record
+		content = utilities_operation_from_bytes( \
+		                            self._get_spill().read(record.spill_handle))
+		record.spill_handle = None
+		record.operation = content['operation']
+		record.undo_patch = content['undo_patch']
+		record.compressed = content['compressed']
+		self._update_record_size(record)
+		return record
+
+	def _get_spill(self):
+		# After a failed write, nothing else is written, but the entries which
+		# are already in the file can still be read
+		if DrHistoryManager._spill is None:
+			DrHistoryManager._spill = DrHistorySpill()
+		return DrHistoryManager._spill
+
+	############################################################################
+	# Statistics ###############################################################
+
+	def get_statistics(self):
+		"""Return a dict describing each entry of the history (its size in
+		memory, and the time it took to apply) and a summary for each tool, to
+		find which operations make the history slow or heavy."""
+		entries = []
+		tools = {}
+		undo_ids = {id(record) for record in self._undo_history}
+		for record in self._get_all_records():
+			if record is self._initial_state:
+				position = 'initial'
+			elif id(record) in undo_ids:
+				position = 'undo'
+			else:
+				position = 'redo'
+			if not record.is_state():
+				kind = 'operation'
+			elif record.is_keyframe:
+				kind = 'keyframe'
+			else:
+				kind = 'state'
+			tool_id = record.tool_id or kind
+			entry = {
+				'position': position,
+				'kind': kind,
+				'tool_id': tool_id,
+				'size': self._get_record_size(record),
+				'replay_cost': record.replay_cost,
+				'has_undo_patch': record.undo_patch is not None,
+				'compressed': record.compressed is not None,
+				'spilled_size': 0,
+			}
+			if record.spill_handle is not None:
+				entry['spilled_size'] = record.spill_handle[1]
+			entries.append(entry)
+
+			summary = tools.setdefault(tool_id, \
+			               {'count': 0, 'size': 0, 'spilled_size': 0, \
+			                              'replay_cost': 0, 'max_replay_cost': 0})
+			summary['count'] += 1
+			summary['size'] += entry['size']
+			summary['spilled_size'] += entry['spilled_size']
+			summary['replay_cost'] += record.replay_cost
+			summary['max_replay_cost'] = max(summary['max_replay_cost'], \
+			                                                  record.replay_cost)
+		if DrHistoryManager._spill is None:
+			spill_size = 0
+		else:
+			spill_size = DrHistoryManager._spill.get_size()
+		return {
+			'memory_usage': sum(entry['size'] for entry in entries),
+			'spill_file_size': spill_size,
+			'replay_length': self._tail_length,
+			'replay_cost': self._tail_cost,
+			'tools': tools,
+			'entries': entries,
+		}
+
+	############################################################################
+	# Journal ##################################################################
+
+	def _start_journal(self):
+		if not self._image.should_use_journal():
+			return
+		try:
+			self._journal = DrHistoryJournal.new()
+		except OSError as e:
+			self._image.window.log_message(str(e))
+
+	def _set_journal_file_path(self):
+		if self._journal is None:
+			return
+		try:
+			self._journal.set_file_path(self._image.get_file_path())
+		except OSError as e:
+			self._image.window.log_message(str(e))
+
+	def _write_journal(self, event_type, **values):
+		"""Queue an event to be written in the journal, and return its index,
+		or None if it's not journaled."""
+		if self._journal is None or self._is_rebuilding:
+			# The operations replayed by a rebuild are already in the journal
+			return None
+		values['type'] = event_type
+		if 'operation' in values:
+			# The history may change the values of the dict (for example when
+			# compressing a state) before the event is written
+			values['operation'] = dict(values['operation'])
+		try:
+			return self._journal.write_event(values)
+		except (TypeError, OSError) as e:
+			# An incomplete journal would restore a wrong history
+			self._image.window.log_message(str(e))
+			self.close_journal(True)
+			return None
+
+	def _compact_journal(self):
+		"""Rewrite the journal with only the events of the entries which are
+		still in the history, so the undone operations, the forgotten keyframes,
+		and the undo/redo events don't accumulate."""
+		if self._journal is None or self._initial_state.journal_index is None:
+			return
+		for record in self._undo_history + self._redo_history:
+			if record.journal_index is None and not record.is_keyframe:
+				# Only keyframes can be missing from the journal
+				return
+		undo_indexes = [record.journal_index for record in self._undo_history \
+		                                     if record.journal_index is not None]
+		redo_indexes = [record.journal_index \
+		                        for record in self._redo_history[::-1]]
+		indexes = [self._initial_state.journal_index] + undo_indexes + redo_indexes
+		try:
+			self._journal.compact(indexes, len(redo_indexes))
+		except (TypeError, OSError) as e:
+			self._image.window.log_message(str(e))
+			self.close_journal(True)
+
+	def close_journal(self, delete):
+		"""Stop writing the journal. If it's not deleted, it may be used to
+		restore the history when the same file is opened again."""
+		if self._journal is None:
+			return
+		try:
+			if not delete:
+				self._journal.set_metadata(closed=True)
+			self._journal.close(delete)
+			DrHistoryJournal.trim_directory()
+		except OSError as e:
+			self._image.window.log_message(str(e))
+		self._journal = None
+
+	def try_restore_journal(self, file_path):
+		"""Restore the history from the journal left by a previous session for
+		the file at this path, if there is one."""
+		if not self._image.should_use_journal():
+			return
+		try:
+			journal = DrHistoryJournal.find_orphan(file_path)
+		except OSError as e:
+			self._image.window.log_message(str(e))
+			return
+		if journal is not None:
+			self.restore_from_journal(journal)
+
+	def restore_from_journal(self, journal):
+		"""Rebuild the lists of the history from the events of the journal,
+		without replaying them, and use this journal from now on. Thanks to the
+		keyframes, only the last operations have to be replayed to rebuild the
+		image."""
+		events = journal.read_events()
+		if len(events) == 0:
+			journal.close(True)
+			return
+		self.close_journal(True)
+		self._journal = journal
+		try:
+			self._journal.set_metadata(closed=False)
+		except OSError as e:
+			self._image.window.log_message(str(e))
+		# The entries of the replaced history may use the spill file
+		self._delete_all_records()
+		for index, event in enumerate(events):
+			self._apply_journal_event(event, index)
+		self._reindex_states()
+		self._recount_tail()
+		if self._image.get_file_path() is None:
+			# Nothing on the disk corresponds to the restored image
+			self._is_saved = False
+		self._enforce_memory_budgets()
+		self._image.restore_last_state()
+		self._rebuild_from_history_async()
+		self._image.update_history_sensitivity()
+
+	def _apply_journal_event(self, event, index):
+		"""Modify the lists of the history the same way the live event did."""
+		event_type = event['type']
+		if event_type == 'initial':
+			if self._initial_state is not None:
+				self._delete_record(self._initial_state)
+			self._initial_state = DrHistoryRecord(event['operation'])
+			self._initial_state.journal_index = index
+			self._count_record(self._initial_state)
+		elif event_type == 'operation':
+			record = DrHistoryRecord(event['operation'])
+			record.replay_cost = event['cost']
+			record.journal_index = index
+			self._count_record(record)
+			self._undo_history.append(record)
+			self._is_saved = False
+		elif event_type == 'state':
+			record = DrHistoryRecord(event['operation'], event['keyframe'])
+			record.journal_index = index
+			self._count_record(record)
+			self._undo_history.append(record)
+			if not event['keyframe']:
+				self._is_saved = True
+		elif event_type == 'undo':
+			while len(self._undo_history) > 0 \
+			and self._undo_history[-1].is_keyframe:
+				self._delete_record(self._undo_history.pop())
+			if len(self._undo_history) > 0:
+				self._redo_history.append(self._undo_history.pop())
+		elif event_type == 'redo':
+			record = self._redo_history.pop()
+			if record.is_state():
+				self._undo_history.append(record)
+			else:
+				# the operation has been applied again, which is an other event
+				self._delete_record(record)
+		elif event_type == 'rewind':
+			for record in self._undo_history:
+				if record.is_keyframe:
+					self._delete_record(record)
+			self._redo_history = [record for record in self._undo_history[::-1] \
+			                       if not record.is_keyframe] + self._redo_history
+			self._undo_history = []
+
+	############################################################################
+	# Rebuild ##################################################################
 
 	def _rebuild_from_history_async(self):
-		if not self._waiting_for_rebuild:
+		self._cancel_replay()
+		self._waiting_for_rebuild = True
+		if self._rebuild_timeout_id is None:
 			# No need to duplicate calls, it will be rebuilt soon anyway
-			self._waiting_for_rebuild = True
-			GLib.timeout_add(500, self._rebuild_from_history, {})
+			self._rebuild_timeout_id = GLib.timeout_add(500, \
+			                                             self._on_rebuild_timeout)
 		# This introduces an artificial delay of half a second, BUT in the case
 		# where an user undoes several operations, i expect between 2 and 4
 		# presses on ctrl+z during these 500ms, so there will be between 2 and 4
 		# times less recomputation.
 
-	def _rebuild_from_history(self, async_cb_data={}):
-		"""Rebuild the image according to the content of the current history.
-		This is used as a GSourceFunc so it should return False."""
-		if not self._waiting_for_rebuild:
-			# It has already been rebuild by an other async call
-			return False
-		self._waiting_for_rebuild = False
+	def _on_rebuild_timeout(self, *args):
+		"""This is used as a GSourceFunc so it should return False."""
+		self._rebuild_timeout_id = None
+		self._rebuild_from_history()
+		return False
 
-		last_save_index = self._get_last_state_index(True)
+	def _rebuild_from_history(self, *args):
+		"""Rebuild the image according to the content of the current history.
+		The operations after the last state are replayed by batches when the
+		main loop is idle, so the window stays responsive. Meanwhile, the canvas
+		keeps showing the previous image, and a progress bar is shown if it
+		lasts long enough."""
+		if self._rebuild_timeout_id is not None:
+			GLib.source_remove(self._rebuild_timeout_id)
+			self._rebuild_timeout_id = None
+		self._cancel_replay()
+		self._waiting_for_rebuild = True
+		self._image.freeze_display()
+
+		last_save_index = self._get_last_state_index()
 		self._image.restore_last_state()
-		history = self._undo_history.copy()
-		self._undo_history = []
-		for op in history:
-			if history.index(op) > last_save_index:
-				# print("do", op['tool_id'])
-				self._get_tool(op['tool_id']).simple_apply_operation(op)
-			else:
-				# print("skip", op['tool_id'])
-				self._undo_history.append(op)
-		self._image.update()
-		return False
+		history = self._undo_history
+		self._undo_history = history[:last_save_index + 1]
+		self._reset_tail()
+		self._replay_queue = history[last_save_index + 1:]
+		self._replay_index = 0
+		if self._replay_step():
+			self._replay_source_id = GLib.idle_add(self._replay_step)
+
+	def _replay_step(self, *args):
+		"""Replay the next operations of the rebuild until it lasts more than
+		`REPLAY_STEP_DURATION`. This is used as a GSourceFunc: it returns True
+		as long as operations remain to be replayed."""
+		queue = self._replay_queue
+		deadline = time.monotonic() + self.REPLAY_STEP_DURATION
+		# If something unexpected interrupts the replay, the display isn't
+		# frozen forever, but the operations not replayed are kept in the
+		# history, which still waits for a rebuild
+		is_over = True
+		self._is_rebuilding = True
+		try:
+			while self._replay_index < len(queue):
+				record = queue[self._replay_index]
+				self._replay_index += 1
+				self._replay_record(record)
+				if time.monotonic() > deadline:
+					break
+			is_over = self._replay_index >= len(queue)
+		finally:
+			self._is_rebuilding = False
+			if is_over:
+				is_complete = self._replay_index >= len(queue)
+				self._replay_source_id = None
+				self._cancel_replay()
+				self._end_rebuild(is_complete)
+		if not is_over:
+			self._image.set_rebuild_progress(self._replay_index / len(queue))
+		return not is_over
+
+	def _replay_record(self, record):
+		"""Apply again the operation of the record. It's skipped if its tool
+		doesn't exist or fails to apply it, so the rest of the history can
+		still be replayed."""
+		tool = self._get_tool(record.tool_id)
+		try:
+			if tool is not None:
+				self._load_record(record)
+				tool.simple_apply_operation(record.operation)
+				self._keep_journal_index(record)
+		except Exception as excp:
+			self._image.window.reveal_action_report(_("Error: the tool " + \
+			                "'%s' failed to replay its operation") % record.tool_id)
+			self._image.window.log_message(str(excp))
+		# The operation is in a new entry now, or it's skipped
+		self._delete_record(record)
+
+	def _keep_journal_index(self, record):
+		"""The replayed operation is in a new entry of the undo-history, but
+		it's still the same event of the journal."""
+		for new_record in reversed(self._undo_history):
+			if new_record.operation is record.operation:
+				new_record.journal_index = record.journal_index
+				return
+			if not new_record.is_keyframe:
+				return
+
+	def _cancel_replay(self):
+		"""Stop the replay of a rebuild, and put the operations which haven't
+		been replayed yet back in the undo-history. The image stays incomplete
+		until an other rebuild."""
+		if self._replay_queue is None:
+			return
+		if self._replay_source_id is not None:
+			GLib.source_remove(self._replay_source_id)
+			self._replay_source_id = None
+		self._undo_history += self._replay_queue[self._replay_index:]
+		self._replay_queue = None
+		self._recount_tail()
+
+	def _stop_rebuild(self):
+		"""Forget the rebuild, because the image already corresponds to the
+		history."""
+		self._cancel_replay()
+		if self._rebuild_timeout_id is not None:
+			GLib.source_remove(self._rebuild_timeout_id)
+			self._rebuild_timeout_id = None
+		if self._waiting_for_rebuild:
+			self._end_rebuild()
+
+	def _end_rebuild(self, is_complete=True):
+		"""Show the image again. If it hasn't been completely rebuilt, the
+		history still waits for a rebuild, so the image isn't considered as
+		final by `finish_rebuild`."""
+		if is_complete:
+			self._waiting_for_rebuild = False
+		self._image.set_rebuild_progress(None)
+		self._image.unfreeze_display()
+
+	def finish_rebuild(self):
+		"""Complete the pending rebuild right now, for example because the
+		pixbuf is about to be read. It does nothing if it's called by the
+		operations being replayed, since they need the incomplete image."""
+		if not self._waiting_for_rebuild or self._is_rebuilding:
+			return
+		if self._replay_queue is None:
+			self._rebuild_from_history()
+		if self._replay_source_id is not None:
+			GLib.source_remove(self._replay_source_id)
+			self._replay_source_id = None
+		while self._replay_queue is not None and self._replay_step():
+			pass
+
+	############################################################################
+	# Other private methods ####################################################
 
 	def _operation_is_ongoing(self):
 		return self._image.active_tool().has_ongoing_operation()
@@ -210,4 +984,3 @@ class DrHistoryManager():
 	############################################################################
 ################################################################################
 
-
@@ -0,0 +1,108 @@
+# Licensed under GPL3 https://github.com/maoschanz/drawing/blob/master/LICENSE
+
+import bisect, mmap, os, tempfile
+from gi.repository import GLib
+
+################################################################################
+
+class DrHistorySpill():
+	"""Memory-mapped swap file where the histories of the images can move
+	their biggest entries. Written data is identified by a handle, which is a
+	tuple `(offset, length)`. The ranges released by the handles are reused by
+	the next writes, so the file doesn't grow during long sessions. The file is
+	unlinked as soon as it's created, so it disappears with the process, even
+	after a crash."""
+	__gtype_name__ = 'DrHistorySpill'
+
+	CHUNK_SIZE = 64 * 1048576
+
+	def __init__(self, **kwargs):
+		cache_dir = os.path.join(GLib.get_user_cache_dir(), 'drawing')
+		os.makedirs(cache_dir, exist_ok=True)
+		fd, path = tempfile.mkstemp(prefix='history-', suffix='.swap', \
+		                                                        dir=cache_dir)
+		os.unlink(path)
+		self._file = os.fdopen(fd, 'r+b')
+		self._mmap = None
+		self._capacity = 0
+		self._end = 0
+		self._live_bytes = 0
+		# Released ranges before `_end`, as (offset, length) tuples sorted by
+		# offset, and never adjacent to each other
+		self._free_ranges = []
+
+	def write(self, data):
+		"""Write the bytes in the first released range big enough, or at the
+		end of the file, and return the handle to read them."""
+		length = len(data)
+		offset = self._take_free_range(length)
+		if offset is None:
+			if self._end + length > self._capacity:
+				self._grow(self._end + length)
+			offset = self._end
+			self._end += length
+		self._mmap[offset:offset + length] = data
+		self._live_bytes += length
+		return (offset, length)
+
+	def read(self, handle):
+		"""Return the bytes written for this handle, and release it."""
+		offset, length = handle
+		data = self._mmap[offset:offset + length]
+		self.release(handle)
+		return data
+
+	def release(self, handle):
+		offset, length = handle
+		self._live_bytes -= length
+		if length == 0:
+			return
+		index = bisect.bisect(self._free_ranges, handle)
+		# Merge with the adjacent released ranges
+		if index > 0:
+			previous = self._free_ranges[index - 1]
+			if previous[0] + previous[1] == offset:
+				offset = previous[0]
+				length += previous[1]
+				index -= 1
+				del self._free_ranges[index]
+		if index < len(self._free_ranges):
+			following = self._free_ranges[index]
+			if offset + length == following[0]:
+				length += following[1]
+				del self._free_ranges[index]
+		if offset + length == self._end:
+			self._end = offset
+		else:
+			self._free_ranges.insert(index, (offset, length))
+
+	def _take_free_range(self, length):
+		for index, (offset, free_length) in enumerate(self._free_ranges):
+			if free_length < length:
+				continue
+			if free_length == length:
+				del self._free_ranges[index]
+			else:
+				self._free_ranges[index] = (offset + length, free_length - length)
+			return offset
+		return None
+
+	def get_size(self):
+		return self._capacity
+
+	def _grow(self, min_size):
+		"""Extend the file and its mapping. The new space is allocated on the
+		disk right now, so if it's full, an OSError is raised here (and the
+		file stays usable) instead of a SIGBUS when the mapping is written."""
+		chunks = (min_size // self.CHUNK_SIZE) + 1
+		capacity = chunks * self.CHUNK_SIZE
+		os.posix_fallocate(self._file.fileno(), self._capacity, \
+		                                             capacity - self._capacity)
+		if self._mmap is not None:
+			self._mmap.close()
+		self._capacity = capacity
+		self._mmap = mmap.mmap(self._file.fileno(), self._capacity)
+
+	############################################################################
+################################################################################
+
@@ -17,7 +17,13 @@
 
 import cairo, random, math
 from gi.repository import Gtk, Gdk, Gio, GdkPixbuf, Pango, GLib
+from .frame_pacer import DrFramePacer
+from .frame_profiler import DrFrameProfiler
+from .image_buffer import DrImageBuffer
 from .history_manager import DrHistoryManager
+from .image_mipmaps import DrMipmaps
+from .image_thumbnail import DrThumbnail
+from .image_tiles import DrSurfaceTiles
 from .selection_manager import DrSelectionManager
 from .properties import DrPropertiesDialog
 from .utilities_files import InvalidFileFormatException
@@ -47,6 +53,7 @@ class DrImage(Gtk.Box):
 	_v_scrollbar = Gtk.Template.Child()
 	reload_info_bar = Gtk.Template.Child()
 	reload_label = Gtk.Template.Child()
+	_rebuild_progress = Gtk.Template.Child()
 
 	# HiDPI scale factor
 	SCALE_FACTOR = 1.0 # XXX doesn't work well enough to be anything else
@@ -63,6 +70,7 @@ class DrImage(Gtk.Box):
 
 		self.gfile = None
 		self.filename = None
+		self._history = None
 		self._waiting_for_monitor = False
 		self._gfile_monitor = None
 		self._can_reload()
@@ -73,9 +81,37 @@ class DrImage(Gtk.Box):
 
 		# Framerate limit
 		self._rendering_is_locked = False
-		self._framerate_hint = 0
+		self._frame_pacer = DrFramePacer()
+		self._minimap_timeout_id = None
+		# Surface shown by the canvas, which the tools draw their previews on
+		self.surface = None
+		# Copy of the surface shown while the history rebuilds the image
+		self._frozen_surface = None
+		# Pixels of the image since the last operation, which `self.surface`
+		# shows with the preview of the tool, and what was last restored
+		self._buffer = DrImageBuffer(self.SCALE_FACTOR)
+		self._restored_version = None
+		self._restored_surface = None
+		self._damaging_tool = None
+		# Whether nothing was drawn on the surface since it was copied in the
+		# buffer, so the next restoration has nothing to do
+		self._is_surface_stable = False
+		# Reductions of the displayed surface, to draw it when zoomed out
+		self._mipmaps = DrMipmaps()
+		# Reduction of the displayed surface shown by the minimap
+		self._thumbnail = DrThumbnail()
+		# Rendering of the background and the image in the widget, kept to
+		# only render the exposed strips when scrolling, with what it shows,
+		# and the areas of the image which changed since (None means all)
+		self._viewport = None
+		self._viewport_spare = None
+		self._viewport_state = None
+		self._viewport_damage = None
+		# Tiles of the displayed surface, to paint only the visible ones
+		self._tiles = DrSurfaceTiles()
 
 		self._ctrl_pressed = False
+		self._frame_profiler = None
 
 		if self.window.devel_mode:
 			# Framerate tracking (debug only)
@@ -83,6 +119,8 @@ class DrImage(Gtk.Box):
 			self._fps_counter = 0
 			if self.window.should_track_framerate:
 				self.reset_fps_counter()
+			if self.window.should_profile_frames:
+				self.set_frame_profiling(True, self.window.frame_timings_log_path)
 
 		self._init_drawing_area()
 
@@ -94,6 +132,13 @@ class DrImage(Gtk.Box):
 		self.window.gsettings.connect('changed::ctrl-zoom', \
 		                                             self._update_zoom_behavior)
 
+		self._update_history_settings()
+		for key in ['history-keyframe-ops', 'history-keyframe-delay', \
+		 'history-memory-budget', 'history-global-budget', 'history-spill', \
+		                                                     'history-journal']:
+			self.window.gsettings.connect('changed::' + key, \
+			                                      self._update_history_settings)
+
 	def _init_drawing_area(self):
 		self._drawing_area.add_events( \
 			Gdk.EventMask.BUTTON_PRESS_MASK | \
@@ -126,6 +171,7 @@ class DrImage(Gtk.Box):
 		rgba = self.window.gsettings.get_strv('ui-background-rgba')
 		self._bg_rgba = (float(rgba[0]), float(rgba[1]), \
 		                                         float(rgba[2]), float(rgba[3]))
+		self._viewport_damage = None
 		# We remember this data here for performance: it will eb used by the
 		# `on_draw` method which is called a lot, and reading a gsettings costs
 		# a lot.
@@ -133,6 +179,68 @@ class DrImage(Gtk.Box):
 	def _update_zoom_behavior(self, *args):
 		self._ctrl_to_zoom = self.window.gsettings.get_boolean('ctrl-zoom')
 
+	def _update_history_settings(self, *args):
+		# Remembered here because the history reads them after each operation
+		self._keyframe_limits = ( \
+			self.window.gsettings.get_int('history-keyframe-ops'), \
+			self.window.gsettings.get_int('history-keyframe-delay') \
+		)
+		# The budgets are set in megabytes but used in bytes
+		self._history_budgets = ( \
+			self.window.gsettings.get_int('history-memory-budget') * 1048576, \
+			self.window.gsettings.get_int('history-global-budget') * 1048576 \
+		)
+		self._history_spill = self.window.gsettings.get_boolean('history-spill')
+		self._history_journal = self.window.gsettings.get_boolean('history-journal')
+
+	def get_keyframe_limits(self):
+		return self._keyframe_limits
+
+	def get_history_budgets(self):
+		return self._history_budgets
+
+	def should_spill_history(self):
+		return self._history_spill
+
+	def should_use_journal(self):
+		return self._history_journal
+
+	def set_rebuild_progress(self, fraction):
+		"""Show the progress of the rebuild of the image, or hide it if the
+		fraction is `None`."""
+		if fraction is None:
+			self._rebuild_progress.set_visible(False)
+		else:
+			self._rebuild_progress.set_fraction(fraction)
+			self._rebuild_progress.set_visible(True)
+
+	def freeze_display(self):
+		"""Keep showing the current image while the surface is rebuilt, so
+		the user doesn't see the intermediate results."""
+		if self._frozen_surface is not None:
+			return
+		self._frozen_surface = cairo.ImageSurface(cairo.Format.ARGB32, \
+		                  self.surface.get_width(), self.surface.get_height())
+		cairo_context = cairo.Context(self._frozen_surface)
+		cairo_context.set_source_surface(self.surface, 0, 0)
+		cairo_context.paint()
+
+	def unfreeze_display(self):
+		self._frozen_surface = None
+		self.update()
+
+	def restore_history_from(self, journal):
+		"""Restore the history (and thus the pixbuf) of an unsaved image from
+		the journal left by a previous session."""
+		self._history.restore_from_journal(journal)
+		self.update_title()
+
+	def get_history_memory_usage(self):
+		return self._history.get_memory_usage()
+
+	def get_history_statistics(self):
+		return self._history.get_statistics()
+
 	############################################################################
 	# Image initialization #####################################################
 
@@ -155,6 +263,10 @@ class DrImage(Gtk.Box):
 		self.selection = DrSelectionManager(self)
 
 		# History initialization
+		if self._history is not None:
+			# The previous history is forgotten, and so is its journal
+			self._history.close_journal(True)
+			self._history.empty_history()
 		self._history = DrHistoryManager(self)
 		self.set_action_sensitivity('undo', False)
 		self.set_action_sensitivity('redo', False)
@@ -176,37 +288,38 @@ class DrImage(Gtk.Box):
 	def restore_last_state(self):
 		"""Set the last saved pixbuf from the history as the main_pixbuf. This
 		is used to rebuild the picture from its history."""
-		last_saved_pixbuf_op = self._history.get_last_saved_state()
-		self._apply_state(last_saved_pixbuf_op)
+		last_saved_state = self._history.get_last_saved_state()
+		self._apply_state(last_saved_state)
 
 	def reset_to_initial_pixbuf(self):
-		self._apply_state(self._history.initial_operation)
+		self._apply_state(self._history.get_initial_state())
 		self._history.rewind_history()
 
-	def _apply_state(self, state_op):
+	def _apply_state(self, state_record):
 		# restore the state found in the history
-		pixbuf = state_op['pixbuf']
+		pixbuf = self._history.get_state_pixbuf(state_record)
+		state_op = state_record.operation
 		width = state_op['width']
 		height = state_op['height']
 		self.set_temp_pixbuf(self._new_blank_pixbuf(1, 1))
 		self.selection.init_pixbuf()
-		self.surface = cairo.ImageSurface(cairo.Format.ARGB32, width, height)
+		if not self._can_reuse_surface(cairo.Format.ARGB32, width, height):
+			self.surface = cairo.ImageSurface(cairo.Format.ARGB32, width, height)
+			self.surface.set_device_scale(self.SCALE_FACTOR, self.SCALE_FACTOR)
+		cairo_context = cairo.Context(self.surface)
+		cairo_context.set_operator(cairo.Operator.SOURCE)
 		if pixbuf is None:
 			# no pixbuf in the operation: the restored state is a blank one
 			rgba = state_op['rgba']
-			r = rgba.red
-			g = rgba.green
-			b = rgba.blue
-			a = rgba.alpha
-			self.set_main_pixbuf(self._new_blank_pixbuf(width, height))
-			cairo_context = cairo.Context(self.surface)
-			cairo_context.set_source_rgba(r, g, b, a)
-			cairo_context.paint()
-			self.update()
-			self.set_surface_as_stable_pixbuf()
+			cairo_context.set_source_rgba(rgba.red, rgba.green, rgba.blue, \
+			                                                        rgba.alpha)
 		else:
-			self.set_main_pixbuf(state_op['pixbuf'].copy())
-			self.use_stable_pixbuf()
+			# The pixbuf of the history is painted on the surface, which is
+			# then copied in the buffer, so the buffer never shares it
+			Gdk.cairo_set_source_pixbuf(cairo_context, pixbuf, 0, 0)
+		cairo_context.paint()
+		self.set_surface_as_stable_pixbuf()
+		self.update()
 
 	############################################################################
 	# (re)loading the pixbuf of a given file ###################################
@@ -247,6 +360,8 @@ class DrImage(Gtk.Box):
 			# ya pas de fenêtre) ouvrir un truc respectant les settings, plutôt
 			# qu'un petit pixbuf corrompu
 		self.try_load_pixbuf(pixbuf)
+		if self.gfile is not None:
+			self._history.try_restore_journal(self.get_file_path())
 		self._can_reload()
 
 	def _connect_gfile_monitoring(self):
@@ -327,8 +442,12 @@ class DrImage(Gtk.Box):
 		if self.window.close_tab(self):
 			self.destroy()
 			self.selection.reset(False)
-			self.main_pixbuf = None
+			self._buffer.clear()
 			self.temp_pixbuf = None
+			# The journal of a saved image is kept, so its history can be
+			# restored if the file is opened again without being modified
+			discard = self.gfile is None or not self.is_saved()
+			self._history.close_journal(discard)
 			self._history.empty_history()
 			return True
 		else:
@@ -363,15 +482,22 @@ class DrImage(Gtk.Box):
 		return self._history.get_saved()
 
 	def remember_current_state(self):
-		self._history.add_state(self.main_pixbuf.copy())
+		self._history.add_state(self.get_main_pixbuf().copy())
 
 	def update_history_sensitivity(self):
 		self.set_action_sensitivity('undo', self._history.can_undo())
 		self.set_action_sensitivity('redo', self._history.can_redo())
 		# self.update_history_actions_labels()
 
-	def add_to_history(self, operation):
-		self._history.add_operation(operation)
+	def add_to_history(self, operation, replay_cost=0, undo_patch=None):
+		# The undo patch covers the area that the operation modified, which is
+		# the only one to copy in the buffer
+		damaged = None
+		if undo_patch is not None:
+			x, y, patch = undo_patch
+			damaged = (x, y, patch.get_width(), patch.get_height())
+		self.set_surface_as_stable_pixbuf(damaged)
+		self._history.add_operation(operation, replay_cost, undo_patch)
 
 	def should_replace(self):
 		if self._history.can_undo():
@@ -379,7 +505,7 @@ class DrImage(Gtk.Box):
 		return not self._history.has_initial_pixbuf()
 
 	def get_initial_rgba(self):
-		return self._history.initial_operation['rgba']
+		return self._history.get_initial_rgba()
 
 	############################################################################
 	# Misc ? ###################################################################
@@ -414,29 +540,149 @@ class DrImage(Gtk.Box):
 		"""Signal callback. Executed when self._drawing_area is redrawn."""
 		if self.window.devel_mode:
 			self._fps_counter += 1
-
-		# Background color
-		cairo_context.set_source_rgba(*self._bg_rgba)
+		start_time = self._frame_pacer.start()
+		profiler = self._frame_profiler
+		if profiler is not None:
+			phase_time = profiler.start()
+
+		# Background color and image (with scroll position)
+		self._update_viewport(cairo_context)
+		cairo_context.set_source_surface(self._viewport, 0, 0)
 		cairo_context.paint()
 
 		# Zoom level
 		cairo_context.scale(self.zoom_level, self.zoom_level)
-
-		# Image (with scroll position)
-		cairo_context.set_source_surface(self.get_surface(), \
-		                                 -1 * self.scroll_x, -1 * self.scroll_y)
-		if self.is_zoomed_surface_sharp():
-			cairo_context.get_source().set_filter(cairo.FILTER_NEAREST)
-		cairo_context.paint()
+		if profiler is not None:
+			phase_time = profiler.add('paint', phase_time)
 
 		# What the tool shows on the canvas, upon what it paints, for example an
 		# overlay to imply how to interact with a previewed operation.
 		self.active_tool().on_draw_above(area, cairo_context)
+		if profiler is not None:
+			phase_time = profiler.add('overlay', phase_time)
 
 		# Limit of the canvas (for readability)
 		utilities_generic_canvas_outline(cairo_context, self.zoom_level, \
 		                              self.get_pixbuf_width() - self.scroll_x, \
 		                             self.get_pixbuf_height() - self.scroll_y)
+		if profiler is not None:
+			profiler.add('outline', phase_time)
+		self._frame_pacer.add_draw_cost(start_time)
+
+	def _update_viewport(self, widget_context):
+		"""Render the background and the image where the viewport is outdated.
+		When only the scroll position changed, what was rendered is shifted, so
+		only the newly exposed strips and the changed areas are rendered."""
+		width = self.get_widget_width()
+		height = self.get_widget_height()
+		state = (width, height, self.zoom_level)
+		areas = None
+		if self._viewport is None or self._viewport_state is None \
+		or self._viewport_state[:3] != state:
+			self._viewport = widget_context.get_target().create_similar( \
+			                             cairo.Content.COLOR_ALPHA, width, height)
+			self._viewport_spare = None
+		elif self._viewport_damage is not None:
+			delta_x = (self._viewport_state[3] - self.scroll_x) * self.zoom_level
+			delta_y = (self._viewport_state[4] - self.scroll_y) * self.zoom_level
+			areas = self._shift_viewport(delta_x, delta_y, width, height)
+		if areas is not None:
+			for extents in self._viewport_damage:
+				widget_area = self._get_widget_area(extents)
+				if widget_area is not None:
+					areas.append(widget_area)
+		self._viewport_state = state + (self.scroll_x, self.scroll_y)
+		self._viewport_damage = []
+		if areas is not None and len(areas) == 0:
+			return
+
+		cairo_context = cairo.Context(self._viewport)
+		if areas is not None:
+			for area in areas:
+				cairo_context.rectangle(*area)
+			cairo_context.clip()
+		cairo_context.set_operator(cairo.Operator.SOURCE)
+		cairo_context.set_source_rgba(*self._bg_rgba)
+		cairo_context.paint()
+		cairo_context.set_operator(cairo.Operator.OVER)
+
+		cairo_context.scale(self.zoom_level, self.zoom_level)
+		displayed_surface = self._get_displayed_surface()
+		# When zoomed out, a reduction of the surface is drawn instead
+		level, displayed_surface = self._mipmaps.get_level(displayed_surface, \
+		                                                        self.zoom_level)
+		reduction = 2 ** level
+		cairo_context.scale(reduction, reduction)
+		self._paint_visible_tiles(cairo_context, displayed_surface, reduction)
+
+	def _shift_viewport(self, delta_x, delta_y, width, height):
+		"""Move what the viewport shows by the given numbers of pixels, and
+		return the list of the exposed areas, or None if the whole viewport has
+		to be rendered again."""
+		if delta_x == 0 and delta_y == 0:
+			return []
+		if abs(delta_x - round(delta_x)) > 0.001 \
+		or abs(delta_y - round(delta_y)) > 0.001:
+			# with this zoom level, the pixels wouldn't be aligned
+			return None
+		delta_x = int(round(delta_x))
+		delta_y = int(round(delta_y))
+		if abs(delta_x) >= width or abs(delta_y) >= height:
+			return None
+		# cairo can't copy a surface on itself, so 2 surfaces are swapped
+		if self._viewport_spare is None:
+			self._viewport_spare = self._viewport.create_similar( \
+			                             cairo.Content.COLOR_ALPHA, width, height)
+		cairo_context = cairo.Context(self._viewport_spare)
+		cairo_context.set_operator(cairo.Operator.SOURCE)
+		cairo_context.set_source_surface(self._viewport, delta_x, delta_y)
+		cairo_context.paint()
+		self._viewport, self._viewport_spare = self._viewport_spare, self._viewport
+
+		areas = []
+		if delta_x > 0:
+			areas.append((0, 0, delta_x, height))
+		elif delta_x < 0:
+			areas.append((width + delta_x, 0, -1 * delta_x, height))
+		if delta_y > 0:
+			areas.append((0, 0, width, delta_y))
+		elif delta_y < 0:
+			areas.append((0, height + delta_y, width, -1 * delta_y))
+		return areas
+
+	def _paint_visible_tiles(self, cairo_context, surface, reduction):
+		"""Paint the tiles of `surface` (the image reduced by `reduction`)
+		which are both visible in the widget and in the area to redraw."""
+		scroll_x = self.scroll_x / reduction
+		scroll_y = self.scroll_y / reduction
+		zoom = self.zoom_level * reduction
+		clip_x1, clip_y1, clip_x2, clip_y2 = cairo_context.clip_extents()
+		x1 = max(scroll_x, clip_x1 + scroll_x)
+		y1 = max(scroll_y, clip_y1 + scroll_y)
+		x2 = min(scroll_x + self.get_widget_width() / zoom, clip_x2 + scroll_x)
+		y2 = min(scroll_y + self.get_widget_height() / zoom, clip_y2 + scroll_y)
+		if x2 <= x1 or y2 <= y1:
+			return
+		is_sharp = self.is_zoomed_surface_sharp()
+		margin = 1 if is_sharp else DrSurfaceTiles.get_margin(zoom)
+		if margin is None:
+			# The filter reads too far around each pixel for the tiles
+			cairo_context.set_source_surface(surface, -scroll_x, -scroll_y)
+			cairo_context.rectangle(x1 - scroll_x, y1 - scroll_y, \
+			                                              x2 - x1, y2 - y1)
+			cairo_context.fill()
+			return
+		# Adjacent tiles have to share their edges exactly
+		cairo_context.set_antialias(cairo.Antialias.NONE)
+		tiles = self._tiles.get_tiles(surface, x1, y1, x2 - x1, y2 - y1, margin)
+		for tile in tiles:
+			x, y, width, height, sub_surface, margin_x, margin_y = tile
+			cairo_context.set_source_surface(sub_surface, \
+			               x - margin_x - scroll_x, y - margin_y - scroll_y)
+			if is_sharp:
+				cairo_context.get_source().set_filter(cairo.FILTER_NEAREST)
+			cairo_context.rectangle(x - scroll_x, y - scroll_y, width, height)
+			cairo_context.fill()
 
 	def on_press_on_area(self, area, event):
 		"""Signal callback. Executed when a mouse button is pressed on
@@ -476,15 +722,28 @@ class DrImage(Gtk.Box):
 
 		elif self.motion_behavior == DrMotionBehavior.DRAW:
 			# implicitly impossible if not self._is_pressed
-			self.active_tool().on_motion_on_area(event, self.surface, event_x, \
-			                                 event_y, self._rendering_is_locked)
 			if self._rendering_is_locked:
+				# the tool takes the event into account, without rendering it
+				self.active_tool().on_motion_on_area(event, self.surface, \
+				                                       event_x, event_y, False)
 				if self.window.devel_mode:
 					self._skipped_frames += 1
 				return
+			profiler = self._frame_profiler
+			if profiler is not None:
+				restored = profiler.get_total('restore')
+			start_time = self._frame_pacer.start()
+			self.active_tool().on_motion_on_area(event, self.surface, event_x, \
+			                                                    event_y, True)
+			self._frame_pacer.add_preview_cost(start_time)
+			if profiler is not None:
+				# the restoration of the surface is measured separately
+				profiler.add('operation', start_time, \
+				                   profiler.get_total('restore') - restored)
 			self._rendering_is_locked = True
-			self.update()
-			GLib.timeout_add(self._framerate_hint, self._async_unlock, {})
+			self.update_area(self.active_tool().get_damaged_area())
+			GLib.timeout_add(self._frame_pacer.get_interval(), \
+			                                          self._async_unlock, {})
 
 		else: # self.motion_behavior == DrMotionBehavior.SLIP:
 			self.scroll_x = self._slip_init_x
@@ -535,10 +794,77 @@ class DrImage(Gtk.Box):
 		tool (it can return None!) to show when Ctrl is pressed."""
 		return self.active_tool().get_tooltip(ev_x, ev_y ,self.motion_behavior)
 
-	def update(self):
+	def update(self, damaged=None):
+		"""Redraw the whole widget. If only the area `damaged` (x, y, width,
+		height) of the image changed, only its reductions are updated."""
 		# print('image.py: _drawing_area.queue_draw')
+		self._invalidate_reductions(damaged)
+		self._drawing_area.queue_draw()
+
+	def update_view(self):
+		"""Redraw the whole widget when only the scroll position or the zoom
+		level changed, so the reductions of the surface are still valid."""
 		self._drawing_area.queue_draw()
 
+	def update_area(self, extents):
+		"""Redraw only the widget area showing the given rectangle (x, y,
+		width, height) of the image, or the whole widget if it's None."""
+		if extents is None or self._frozen_surface is not None:
+			self.update()
+			return
+		self._invalidate_reductions(extents)
+		widget_area = self._get_widget_area(extents)
+		if widget_area is not None:
+			self._drawing_area.queue_draw_area(*widget_area)
+
+	def _get_widget_area(self, extents):
+		"""Return the area (x, y, width, height) of the widget showing the
+		given rectangle of the image, or None if it's not visible."""
+		x, y, width, height = extents
+		# The additional pixel of the image is for the interpolation of the
+		# zoomed surface, and the additional pixel of the widget for rounding
+		x1 = math.floor((x - 1 - self.scroll_x) * self.zoom_level) - 1
+		y1 = math.floor((y - 1 - self.scroll_y) * self.zoom_level) - 1
+		x2 = math.ceil((x + width + 1 - self.scroll_x) * self.zoom_level) + 1
+		y2 = math.ceil((y + height + 1 - self.scroll_y) * self.zoom_level) + 1
+		x1 = max(0, x1)
+		y1 = max(0, y1)
+		x2 = min(self.get_widget_width(), x2)
+		y2 = min(self.get_widget_height(), y2)
+		if x2 <= x1 or y2 <= y1:
+			return None
+		return (x1, y1, x2 - x1, y2 - y1)
+
+	def _invalidate_reductions(self, extents):
+		"""The area (x, y, width, height) of the displayed surface changed, or
+		all of it if `extents` is None: the viewport and the reductions of the
+		surface are outdated, and the minimap has to show the change."""
+		if extents is None:
+			self._viewport_damage = None
+		elif self._viewport_damage is not None:
+			self._viewport_damage.append(extents)
+		self._mipmaps.invalidate(extents)
+		self._thumbnail.invalidate(extents)
+		if self._minimap_timeout_id is None:
+			# The minimap is updated at most once per preview frame, even if the
+			# image is updated several times meanwhile
+			self._minimap_timeout_id = GLib.timeout_add( \
+			         self._frame_pacer.get_interval(), self._on_minimap_timeout)
+
+	def _on_minimap_timeout(self, *args):
+		"""This is used as a GSourceFunc so it should return False."""
+		self._minimap_timeout_id = None
+		if self.window.minimap.get_visible() \
+		and self.window.get_active_image() is self:
+			self.window.minimap.update_content()
+		return False
+
+	def _get_displayed_surface(self):
+		if self._frozen_surface is None:
+			return self.get_surface()
+		else:
+			return self._frozen_surface
+
 	def _async_unlock(self, content_params={}):
 		"""This is used as a GSourceFunc so it should return False."""
 		self._rendering_is_locked = False
@@ -560,37 +886,163 @@ class DrImage(Gtk.Box):
 		self.update()
 		self.reload_from_disk()
 
-	def set_surface_as_stable_pixbuf(self):
-		w = self.surface.get_width()
-		h = self.surface.get_height()
-		self.main_pixbuf = Gdk.pixbuf_get_from_surface(self.surface, 0, 0, w, h)
-		self._framerate_hint = math.sqrt(w * h) - 1000
-		self._framerate_hint = int(self._framerate_hint * 0.2)
-		# between 500 and 33ms (= between 2 and 30 fps)
-		self._framerate_hint = max(33, min(500, self._framerate_hint))
-		# print("image.py: hint =", self._framerate_hint)
+	def set_surface_as_stable_pixbuf(self, damaged=None):
+		"""Copy the surface in the buffer, as the new state of the image. If
+		the surface differs from the buffer only in the area `damaged` (x, y,
+		width, height), only this area is copied. The surface is then identical
+		to the buffer, so the next restoration has nothing to restore."""
+		self._buffer.set_surface(self.surface, damaged)
+		self._restored_version = self._buffer.version
+		self._restored_surface = self.surface
+		self._damaging_tool = None
+		self._is_surface_stable = True
 
 	def use_stable_pixbuf(self):
 		"""This is called by tools' `restore_pixbuf`, so at the beginning of
-		each operation (even unapplied)."""
-		# maybe the "scale" parameter should be 1 instead of 0
-		self.surface = Gdk.cairo_surface_create_from_pixbuf(self.main_pixbuf, 0, None)
+		each operation (even unapplied). The surface is copied from the buffer,
+		or if the buffer didn't change and the tool which previously drew on
+		the surface knows where it drew, only this area is restored. Nothing is
+		restored if nothing was drawn since the last applied operation."""
+		if self._frame_profiler is not None:
+			start_time = self._frame_profiler.start()
+		damaging_tool = self._damaging_tool
+		self._damaging_tool = None
+		# The caller is about to draw on the surface
+		is_stable = self._is_surface_stable
+		self._is_surface_stable = False
+		base_surface = self._buffer.get_surface()
+		if self._restored_version != self._buffer.version:
+			# The content of the buffer changed since the last restoration
+			self._restored_version = self._buffer.version
+			damaging_tool = None
+			is_stable = False
+		if self.surface is not self._restored_surface:
+			# The surface has been replaced since the last restoration
+			damaging_tool = None
+			is_stable = False
+		if not is_stable:
+			# else nothing was drawn on the surface since it became the buffer
+			self._restore_surface(base_surface, damaging_tool)
+		if self._frame_profiler is not None:
+			self._frame_profiler.add('restore', start_time)
 		# print('image.py: use_stable_pixbuf')
-		self.surface.set_device_scale(self.SCALE_FACTOR, self.SCALE_FACTOR)
+
+	def _restore_surface(self, base_surface, damaging_tool):
+		if damaging_tool is None:
+			extents = None
+		else:
+			extents = damaging_tool.get_previewed_extents()
+		if extents is None and not self._can_reuse_surface( \
+		                            base_surface.get_format(), \
+		                 base_surface.get_width(), base_surface.get_height()):
+			self.surface = cairo.ImageSurface(base_surface.get_format(), \
+			             base_surface.get_width(), base_surface.get_height())
+			self.surface.set_device_scale(self.SCALE_FACTOR, self.SCALE_FACTOR)
+		self._restored_surface = self.surface
+		cairo_context = cairo.Context(self.surface)
+		cairo_context.set_operator(cairo.Operator.SOURCE)
+		cairo_context.set_source_surface(base_surface, 0, 0)
+		if extents is not None:
+			cairo_context.rectangle(*extents)
+			cairo_context.clip()
+		cairo_context.paint()
+
+	def _can_reuse_surface(self, surface_format, width, height):
+		"""Whether the image can be painted over the current surface, instead
+		of a new one. The surface is then the same object, so its reductions
+		and tiles are kept, and only the area which the caller declares as
+		damaged (with `update`) is reduced again."""
+		if self.surface is None:
+			return False
+		return self.surface.get_format() == surface_format \
+		                            and self.surface.get_width() == width \
+		                            and self.surface.get_height() == height
+
+	def restore_surface_area(self, extents, tool):
+		"""Copy the given area (x, y, width, height) of the buffer back on
+		the surface, if nothing but this tool drew on the surface since the
+		last restoration. Return whether it was possible."""
+		if self._damaging_tool is not tool \
+		or self._restored_version != self._buffer.version \
+		or self.surface is not self._restored_surface:
+			return False
+		cairo_context = cairo.Context(self.surface)
+		cairo_context.set_operator(cairo.Operator.SOURCE)
+		cairo_context.set_source_surface(self._buffer.get_surface(), 0, 0)
+		cairo_context.rectangle(*extents)
+		cairo_context.fill()
+		return True
+
+	def set_damaging_tool(self, tool):
+		"""Called by a tool right after restoring the surface, if it will be
+		the only one to draw on it until the next restoration. The area it
+		draws is then the only one to restore."""
+		self._damaging_tool = tool
+		self._is_surface_stable = False
+
+	def get_pixbuf_patch(self, x, y, width, height):
+		"""Return a tuple (x, y, pixbuf) with a copy of the given area of the
+		image, clamped to its size, or None if the area is empty."""
+		x2 = min(x + width, self.get_pixbuf_width())
+		y2 = min(y + height, self.get_pixbuf_height())
+		x = max(0, x)
+		y = max(0, y)
+		if x2 <= x or y2 <= y:
+			return None
+		patch = self._buffer.get_patch(x, y, x2 - x, y2 - y)
+		return (x, y, patch)
+
+	def apply_pixbuf_patch(self, x, y, patch):
+		"""Paste a patch produced by `get_pixbuf_patch` on the image, and
+		return whether it was possible."""
+		width = patch.get_width()
+		height = patch.get_height()
+		if x + width > self.get_pixbuf_width() \
+		or y + height > self.get_pixbuf_height():
+			return False
+		# The surface is restored first, so once the patch is pasted on both,
+		# they're identical again without copying the whole image
+		self.use_stable_pixbuf()
+		self._buffer.apply_patch(x, y, patch)
+		cairo_context = cairo.Context(self.surface)
+		cairo_context.set_operator(cairo.Operator.SOURCE)
+		cairo_context.set_source_surface(self._buffer.get_surface(), 0, 0)
+		cairo_context.rectangle(x, y, width, height)
+		cairo_context.fill()
+		self._restored_version = self._buffer.version
+		self._is_surface_stable = True
+		self.update((x, y, width, height))
+		return True
 
 	def get_pixbuf_width(self):
-		return self.main_pixbuf.get_width()
+		return self._buffer.get_width()
 
 	def get_pixbuf_height(self):
-		return self.main_pixbuf.get_height()
+		return self._buffer.get_height()
+
+	def get_main_pixbuf(self):
+		"""Return the image since the last operation as a pixbuf, which is
+		produced from the surface of the buffer only when it's needed. It must
+		not be modified."""
+		return self._get_rebuilt_buffer().get_pixbuf()
+
+	def copy_main_surface(self):
+		"""Return a copy of the image since the last operation, as a cairo
+		surface which can be modified."""
+		return self._get_rebuilt_buffer().copy_surface()
+
+	def _get_rebuilt_buffer(self):
+		# If the history is being rebuilt, the buffer only has some of the
+		# operations yet, so the rebuild is completed before it's read
+		self._history.finish_rebuild()
+		return self._buffer
 
 	def set_main_pixbuf(self, new_pixbuf):
-		"""Safely set a pixbuf as the main one (not used everywhere internally
-		in image.py, but it's normal)."""
+		"""Safely set a pixbuf as the main one."""
 		if new_pixbuf is None:
 			raise NoPixbufNoChangeException('main_pixbuf')
 		else:
-			self.main_pixbuf = new_pixbuf
+			self._buffer.set_pixbuf(new_pixbuf)
 
 	############################################################################
 	# Temporary pixbuf management ##############################################
@@ -617,7 +1069,8 @@ class DrImage(Gtk.Box):
 		if self.window.should_track_framerate:
 			# Context: this is a debug information that users will never see
 			msg = _("%s frames per second") % self._fps_counter
-			msg += " (" + str(self._skipped_frames) + " motion inputs skipped)"
+			msg += " (" + str(self._skipped_frames) + " motion inputs skipped, "
+			msg += str(self._frame_pacer.get_interval()) + " ms between previews)"
 			self.window.reveal_message(msg)
 			self._fps_counter = 0
 			self._skipped_frames = 0
@@ -626,6 +1079,25 @@ class DrImage(Gtk.Box):
 			self.window.reveal_message("Tracking stopped.", True)
 		return False
 
+	def set_frame_profiling(self, is_active, log_path=None):
+		"""Development only: start or stop measuring the duration of each
+		phase of the frames, and showing their percentiles every second. The
+		measures are also written in the file at `log_path`, if any."""
+		if self._frame_profiler is not None:
+			self._frame_profiler.close()
+			self._frame_profiler = None
+		if is_active:
+			self._frame_profiler = DrFrameProfiler(log_path)
+			GLib.timeout_add(1000, self._show_frame_profile, self._frame_profiler)
+
+	def _show_frame_profile(self, profiler):
+		"""This is used as a GSourceFunc so it should return False to stop."""
+		if profiler is not self._frame_profiler:
+			return False
+		if self.window.get_active_image() is self:
+			self.window.reveal_message(profiler.get_summary())
+		return True
+
 	############################################################################
 	# Interaction with the minimap #############################################
 
@@ -635,16 +1107,11 @@ class DrImage(Gtk.Box):
 	def get_widget_height(self):
 		return self._drawing_area.get_allocated_height()
 
-	def generate_mini_pixbuf(self, preview_size):
-		mpb_width = self.get_pixbuf_width()
-		mpb_height = self.get_pixbuf_height()
-		if mpb_height > mpb_width:
-			mw = preview_size * (mpb_width/mpb_height)
-			mh = preview_size
-		else:
-			mw = preview_size
-			mh = preview_size * (mpb_height/mpb_width)
-		return self.main_pixbuf.scale_simple(mw, mh, GdkPixbuf.InterpType.TILES)
+	def get_thumbnail(self, preview_size):
+		"""Return a surface with the displayed image reduced to fit in a
+		square of `preview_size` pixels, which must not be modified."""
+		return self._thumbnail.get_surface(self._get_displayed_surface(), \
+		                                                         preview_size)
 
 	def get_minimap_need_overlay(self):
 		mpb_width = self.get_pixbuf_width()
@@ -745,7 +1212,7 @@ class DrImage(Gtk.Box):
 
 	def on_scrollbar_value_change(self, scrollbar):
 		self.correct_coords(self._h_scrollbar.get_value(), self._v_scrollbar.get_value())
-		self.update() # allowing imperfect framerate would likely be useless
+		self.update_view() # allowing imperfect framerate would likely be useless
 
 	def reset_deltas(self, delta_x, delta_y):
 		if delta_x > 0:
@@ -833,7 +1300,7 @@ class DrImage(Gtk.Box):
 		if self.is_zoomed_surface_sharp():
 			self.window.minimap.set_zoom_label(self.zoom_level * 100)
 		self.fake_scrollbar_update()
-		self.update()
+		self.update_view()
 
 	def set_opti_zoom_level(self, *args):
 		allocated_width = self.get_widget_width()
@@ -0,0 +1,120 @@
+# Licensed under GPL3 https://github.com/maoschanz/drawing/blob/master/LICENSE
+
+import cairo
+from gi.repository import Gdk
+
+################################################################################
+
+class DrImageBuffer():
+	"""The pixels of an image, as they are since the last applied operation.
+	The ARGB32 cairo surface is the reference: a GdkPixbuf is produced from it
+	only when something needs one (saving, the clipboard, the transform tools,
+	the states of the history, ...), and it's kept until the pixels change.
+	When a pixbuf is set, it's converted to a surface only when needed.
+
+	The version changes each time the pixels change, so the image can tell if
+	what it restored from the buffer is still up to date."""
+	__gtype_name__ = 'DrImageBuffer'
+
+	def __init__(self, scale_factor, **kwargs):
+		self._scale_factor = scale_factor
+		self._surface = None
+		self._pixbuf = None
+		self.version = 0
+
+	def clear(self):
+		self._surface = None
+		self._pixbuf = None
+		self.version += 1
+
+	def get_width(self):
+		if self._surface is None:
+			return self._pixbuf.get_width()
+		return self._surface.get_width()
+
+	def get_height(self):
+		if self._surface is None:
+			return self._pixbuf.get_height()
+		return self._surface.get_height()
+
+	############################################################################
+
+	def get_surface(self):
+		"""Return the surface, which must not be modified."""
+		if self._surface is None and self._pixbuf is not None:
+			# maybe the "scale" parameter should be 1 instead of 0
+			self._surface = Gdk.cairo_surface_create_from_pixbuf(self._pixbuf, \
+			                                                          0, None)
+			self._surface.set_device_scale(self._scale_factor, \
+			                                               self._scale_factor)
+		return self._surface
+
+	def set_surface(self, surface, extents=None):
+		"""Copy the pixels of `surface` as the new content of the buffer. If
+		they differ only in the area `extents` (x, y, width, height), only this
+		area is copied, in place."""
+		current = None
+		if extents is not None:
+			current = self.get_surface()
+		if current is None \
+		or current.get_width() != surface.get_width() \
+		or current.get_height() != surface.get_height():
+			self._surface = self._copy(surface)
+		else:
+			cairo_context = cairo.Context(current)
+			cairo_context.set_operator(cairo.Operator.SOURCE)
+			cairo_context.set_source_surface(surface, 0, 0)
+			cairo_context.rectangle(*extents)
+			cairo_context.fill()
+		self._pixbuf = None
+		self.version += 1
+
+	def copy_surface(self):
+		"""Return a copy of the surface, which can be modified."""
+		return self._copy(self.get_surface())
+
+	def get_pixbuf(self):
+		"""Return the content of the buffer as a pixbuf, which must not be
+		modified."""
+		if self._pixbuf is None and self._surface is not None:
+			self._pixbuf = Gdk.pixbuf_get_from_surface(self._surface, 0, 0, \
+			                     self._surface.get_width(), self._surface.get_height())
+		return self._pixbuf
+
+	def set_pixbuf(self, pixbuf):
+		self._pixbuf = pixbuf
+		self._surface = None
+		self.version += 1
+
+	############################################################################
+
+	def get_patch(self, x, y, width, height):
+		"""Return a new pixbuf with the pixels of the given area, which has to
+		be inside the buffer."""
+		if self._pixbuf is not None:
+			return self._pixbuf.new_subpixbuf(x, y, width, height).copy()
+		return Gdk.pixbuf_get_from_surface(self._surface, x, y, width, height)
+
+	def apply_patch(self, x, y, patch):
+		"""Paste the pixbuf at the given coordinates, in place."""
+		cairo_context = cairo.Context(self.get_surface())
+		cairo_context.set_operator(cairo.Operator.SOURCE)
+		Gdk.cairo_set_source_pixbuf(cairo_context, patch, x, y)
+		cairo_context.rectangle(x, y, patch.get_width(), patch.get_height())
+		cairo_context.fill()
+		self._pixbuf = None
+		self.version += 1
+
+	def _copy(self, surface):
+		new_surface = cairo.ImageSurface(cairo.Format.ARGB32, \
+		                               surface.get_width(), surface.get_height())
+		new_surface.set_device_scale(self._scale_factor, self._scale_factor)
+		cairo_context = cairo.Context(new_surface)
+		cairo_context.set_operator(cairo.Operator.SOURCE)
+		cairo_context.set_source_surface(surface, 0, 0)
+		cairo_context.paint()
+		return new_surface
+
+	############################################################################
+################################################################################
+
@@ -0,0 +1,112 @@
+# Licensed under GPL3 https://github.com/maoschanz/drawing/blob/master/LICENSE
+
+import cairo, math
+
+################################################################################
+
+class DrMipmaps():
+	"""Reductions of a surface to the half, the quarter, etc. of its size, so
+	the image can be shown zoomed out without reducing the whole surface at
+	each frame. The levels are built when they're needed, and are divided in
+	tiles: when the surface changes, only the tiles of the changed area are
+	reduced again."""
+	__gtype_name__ = 'DrMipmaps'
+
+	# Size of a tile, in pixels of the surface. It has to be a multiple of
+	# 2 ** MAX_LEVEL, so the tiles of all the levels are aligned.
+	TILE_SIZE = 256
+	MAX_LEVEL = 4
+
+	def __init__(self, **kwargs):
+		self.clear()
+
+	def clear(self):
+		"""Forget the source surface, and release the memory of the levels."""
+		self._source = None
+		self._size = None
+		# The level `n` (reduced by 2 ** n) is at the index `n - 1`, with the
+		# set of its tiles to reduce again, or None if the whole level is.
+		self._levels = []
+		self._dirty = []
+
+	def invalidate(self, extents=None):
+		"""Tell the area (x, y, width, height) of the source surface changed,
+		or the whole surface if `extents` is None."""
+		if extents is None:
+			self._dirty = [None] * len(self._dirty)
+			return
+		x, y, width, height = extents
+		# the additional pixel is for the interpolation
+		first_x = max(0, int(x) - 1) // self.TILE_SIZE
+		first_y = max(0, int(y) - 1) // self.TILE_SIZE
+		last_x = max(0, int(x + width) + 1) // self.TILE_SIZE
+		last_y = max(0, int(y + height) + 1) // self.TILE_SIZE
+		tiles = set()
+		for tile_x in range(first_x, last_x + 1):
+			for tile_y in range(first_y, last_y + 1):
+				tiles.add((tile_x, tile_y))
+		for dirty_tiles in self._dirty:
+			if dirty_tiles is not None:
+				dirty_tiles.update(tiles)
+
+	def get_level(self, surface, zoom_level):
+		"""Return the level to use to show `surface` at this zoom level, and
+		the surface of this level, which is `surface` itself for the level 0.
+		The level is the largest one which isn't smaller than the zoomed
+		image, so it's reduced again when drawn, but never enlarged."""
+		if zoom_level >= 1:
+			self.clear()
+			return 0, surface
+		level = min(self.MAX_LEVEL, int(math.floor(math.log2(1 / zoom_level))))
+		if level < 1:
+			return 0, surface
+		size = (surface.get_width(), surface.get_height())
+		if surface is not self._source or size != self._size:
+			self.clear()
+			self._source = surface
+			self._size = size
+		while len(self._levels) < level:
+			self._levels.append(None)
+			self._dirty.append(None)
+		for index in range(1, level + 1):
+			self._update_level(index)
+		return level, self._levels[level - 1]
+
+	def _update_level(self, level):
+		"""Reduce the changed tiles of a level from the previous level, which
+		has to be up to date."""
+		index = level - 1
+		if index == 0:
+			source = self._source
+		else:
+			source = self._levels[index - 1]
+		if self._levels[index] is None:
+			width = max(1, math.ceil(self._size[0] / 2 ** level))
+			height = max(1, math.ceil(self._size[1] / 2 ** level))
+			self._levels[index] = cairo.ImageSurface(cairo.Format.ARGB32, \
+			                                                     width, height)
+			self._dirty[index] = None
+		dirty_tiles = self._dirty[index]
+		if dirty_tiles is not None and len(dirty_tiles) == 0:
+			return
+
+		cairo_context = cairo.Context(self._levels[index])
+		if dirty_tiles is not None:
+			tile_size = self.TILE_SIZE // 2 ** level
+			for tile_x, tile_y in dirty_tiles:
+				cairo_context.rectangle(tile_x * tile_size, tile_y * tile_size, \
+				                                         tile_size, tile_size)
+			cairo_context.clip()
+		# With a scale of exactly 0.5, the bilinear filter gives the average of
+		# each square of 4 pixels.
+		cairo_context.scale(0.5, 0.5)
+		cairo_context.set_operator(cairo.Operator.SOURCE)
+		cairo_context.set_source_surface(source, 0, 0)
+		cairo_context.get_source().set_filter(cairo.Filter.BILINEAR)
+		cairo_context.get_source().set_extend(cairo.Extend.PAD)
+		cairo_context.paint()
+		self._dirty[index] = set()
+
+	############################################################################
+################################################################################
+
@@ -0,0 +1,74 @@
+# Licensed under GPL3 https://github.com/maoschanz/drawing/blob/master/LICENSE
+
+import cairo, math
+
+################################################################################
+
+class DrThumbnail():
+	"""Reduction of a surface fitting in a square, as shown by the minimap.
+	It's kept between the uses, and when the surface changes, only the pixels
+	of the thumbnail covering the changed area are computed again."""
+	__gtype_name__ = 'DrThumbnail'
+
+	def __init__(self, **kwargs):
+		self._surface = None
+		self._damaged = None
+
+	def invalidate(self, extents=None):
+		"""Tell the area (x, y, width, height) of the source surface changed,
+		or the whole surface if `extents` is None."""
+		if extents is None or self._surface is None:
+			self._surface = None
+			return
+		if self._damaged is None:
+			self._damaged = extents
+			return
+		x = min(self._damaged[0], extents[0])
+		y = min(self._damaged[1], extents[1])
+		x2 = max(self._damaged[0] + self._damaged[2], extents[0] + extents[2])
+		y2 = max(self._damaged[1] + self._damaged[3], extents[1] + extents[3])
+		self._damaged = (x, y, x2 - x, y2 - y)
+
+	def get_surface(self, source, size):
+		"""Return the thumbnail of `source` fitting in a square of `size`
+		pixels, up to date. It must not be modified."""
+		width = source.get_width()
+		height = source.get_height()
+		if height > width:
+			thumb_width = max(1, int(size * width / height))
+			thumb_height = size
+		else:
+			thumb_width = size
+			thumb_height = max(1, int(size * height / width))
+		if self._surface is None or thumb_width != self._surface.get_width() \
+		or thumb_height != self._surface.get_height():
+			self._surface = cairo.ImageSurface(cairo.Format.ARGB32, \
+			                                        thumb_width, thumb_height)
+			self._damaged = (0, 0, width, height)
+		if self._damaged is not None:
+			self._reduce(source, self._damaged)
+			self._damaged = None
+		return self._surface
+
+	def _reduce(self, source, extents):
+		ratio_x = self._surface.get_width() / source.get_width()
+		ratio_y = self._surface.get_height() / source.get_height()
+		x, y, width, height = extents
+		# the additional pixels are for the interpolation
+		x1 = max(0, math.floor(x * ratio_x) - 1)
+		y1 = max(0, math.floor(y * ratio_y) - 1)
+		x2 = math.ceil((x + width) * ratio_x) + 1
+		y2 = math.ceil((y + height) * ratio_y) + 1
+		cairo_context = cairo.Context(self._surface)
+		cairo_context.rectangle(x1, y1, x2 - x1, y2 - y1)
+		cairo_context.clip()
+		cairo_context.scale(ratio_x, ratio_y)
+		cairo_context.set_operator(cairo.Operator.SOURCE)
+		cairo_context.set_source_surface(source, 0, 0)
+		cairo_context.get_source().set_filter(cairo.Filter.GOOD)
+		cairo_context.get_source().set_extend(cairo.Extend.PAD)
+		cairo_context.paint()
+
+	############################################################################
+################################################################################
+
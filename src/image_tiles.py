@@ -0,0 +1,76 @@
+# Licensed under GPL3 https://github.com/maoschanz/drawing/blob/master/LICENSE
+
+import cairo, math
+
+################################################################################
+
+class DrSurfaceTiles():
+	"""Grid of fixed-size tiles over a surface. The tiles are sub-surfaces
+	sharing the memory of the surface, so what the tools draw on the surface
+	is in the tiles, without any copy. Each tile also covers a margin around
+	it, as wide as what the filter reads beyond a pixel at the current zoom
+	level, so the interpolation is the same as with the surface."""
+	__gtype_name__ = 'DrSurfaceTiles'
+
+	TILE_SIZE = 256
+	# Above this margin, the tiles would cost more than they save
+	MAX_MARGIN = 16
+
+	def __init__(self, **kwargs):
+		self._surface = None
+		self._size = None
+		self._margin = None
+		self._tiles = {}
+
+	@classmethod
+	def get_margin(cls, zoom):
+		"""Return the margin needed by the tiles of a surface painted with
+		this scale, or None if it's too wide for the tiles to be useful. When
+		reduced, each pixel is computed from about `1 / zoom` source pixels."""
+		margin = max(1, math.ceil(1 / zoom))
+		if margin > cls.MAX_MARGIN:
+			return None
+		return margin
+
+	def get_tiles(self, surface, x, y, width, height, margin):
+		"""Return the tiles of `surface` which intersect the area, as a list
+		of tuples (x, y, width, height, sub-surface, margin x, margin y)."""
+		size = (surface.get_width(), surface.get_height())
+		if surface is not self._surface or size != self._size \
+		or margin != self._margin:
+			self._surface = surface
+			self._size = size
+			self._margin = margin
+			self._tiles = {}
+		x1 = max(0, int(x))
+		y1 = max(0, int(y))
+		x2 = min(size[0], int(x + width) + 1)
+		y2 = min(size[1], int(y + height) + 1)
+		tiles = []
+		if x2 <= x1 or y2 <= y1:
+			return tiles
+		for tile_y in range(y1 // self.TILE_SIZE, (y2 - 1) // self.TILE_SIZE + 1):
+			for tile_x in range(x1 // self.TILE_SIZE, (x2 - 1) // self.TILE_SIZE + 1):
+				if (tile_x, tile_y) not in self._tiles:
+					self._tiles[(tile_x, tile_y)] = self._build_tile(tile_x, tile_y)
+				tiles.append(self._tiles[(tile_x, tile_y)])
+		return tiles
+
+	def _build_tile(self, tile_x, tile_y):
+		x = tile_x * self.TILE_SIZE
+		y = tile_y * self.TILE_SIZE
+		width = min(self.TILE_SIZE, self._size[0] - x)
+		height = min(self.TILE_SIZE, self._size[1] - y)
+		margin_x = min(self._margin, x)
+		margin_y = min(self._margin, y)
+		sub_width = min(self._size[0] - x + margin_x, \
+		                                     width + margin_x + self._margin)
+		sub_height = min(self._size[1] - y + margin_y, \
+		                                    height + margin_y + self._margin)
+		sub_surface = self._surface.create_for_rectangle(x - margin_x, \
+		                               y - margin_y, sub_width, sub_height)
+		return (x, y, width, height, sub_surface, margin_x, margin_y)
+
+	############################################################################
+################################################################################
+
@@ -1,7 +1,7 @@
 # Licensed under GPL3 https://github.com/maoschanz/drawing/blob/master/LICENSE
 
 import cairo
-from gi.repository import Gtk, Gdk, GdkPixbuf
+from gi.repository import Gtk, Gdk
 
 class DrMinimap(Gtk.Popover):
 	__gtype_name__ = 'DrMinimap'
@@ -10,8 +10,7 @@ class DrMinimap(Gtk.Popover):
 		super().__init__(**kwargs)
 		self._window = window
 		self._preview_size = self._window.gsettings.get_int('preview-size')
-		self.mini_pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, 300, 300)
-		self._mini_surface = cairo.ImageSurface(cairo.Format.ARGB32, 5, 5)
+		self._thumbnail = cairo.ImageSurface(cairo.Format.ARGB32, 5, 5)
 
 		builder = Gtk.Builder.new_from_resource( \
 		                          '/com/github/maoschanz/drawing/ui/minimap.ui')
@@ -50,65 +49,72 @@ class DrMinimap(Gtk.Popover):
 		self.update_overlay()
 
 	def update_content(self):
-		"""Update the minimap's content."""
+		"""Update the minimap's content. The image only updates the pixels of
+		its thumbnail where it changed since the last time."""
 		image = self._window.get_active_image()
-		self.mini_pixbuf = image.generate_mini_pixbuf(self._preview_size)
-		pix_width = self.mini_pixbuf.get_width()
-		pix_height = self.mini_pixbuf.get_height()
+		self._thumbnail = image.get_thumbnail(self._preview_size)
+		pix_width = self._thumbnail.get_width()
+		pix_height = self._thumbnail.get_height()
 		self._minimap_area.set_size_request(pix_width, pix_height)
 
 		self.update_overlay(True)
 
+	def get_thumbnail(self):
+		"""Return the surface with the thumbnail of the active image, as
+		shown by the minimap, which must not be modified."""
+		return self._thumbnail
+
 	def update_overlay(self, force_update=False):
 		"""Update the overlay on the minimap, based on the zoom level and the
-		scroll coordinates."""
+		scroll coordinates. It's drawn upon the thumbnail when the area is
+		redrawn, so the thumbnail itself doesn't change."""
 		if not self.get_visible() and not force_update:
 			return
-		image = self._window.get_active_image()
-		self._mini_surface = Gdk.cairo_surface_create_from_pixbuf( \
-		                                              self.mini_pixbuf, 0, None)
-		if image.get_minimap_need_overlay():
-			size_ratio = image.get_minimap_ratio(self.mini_pixbuf.get_width())
-			mini_x = int(image.scroll_x * size_ratio)
-			mini_y = int(image.scroll_y * size_ratio)
-			visible_width, visible_height = image.get_visible_size()
-			# We add pixels because those "int" truncate a pixel on each side
-			mini_width = int(visible_width * size_ratio) + 2
-			mini_height = int(visible_height * size_ratio) + 2
-
-			# Set up a cairo context
-			mini_context = cairo.Context(self._mini_surface)
-			mini_context.new_path()
-			mini_context.set_line_width(1)
-			mini_context.set_antialias(cairo.Antialias.NONE)
-			mini_context.set_line_cap(cairo.LineCap.SQUARE)
-
-			# Path around the visible area
-			mini_context.move_to(mini_x, mini_y)
-			mini_context.line_to(mini_x, mini_height + mini_y)
-			mini_context.line_to(mini_width + mini_x, mini_height + mini_y)
-			mini_context.line_to(mini_width + mini_x, mini_y)
-			mini_context.line_to(mini_x, mini_y)
-
-			# Path around the entire mini-surface
-			pix_width = self.mini_pixbuf.get_width()
-			pix_height = self.mini_pixbuf.get_height()
-			mini_context.move_to(0, 0)
-			mini_context.line_to(pix_width, 0)
-			# We add pixels because those "int" truncate a pixel on each side
-			mini_context.line_to(pix_width + 1, pix_height + 1)
-			mini_context.line_to(0, pix_height)
-			mini_context.close_path()
-
-			# Fill between these 2 paths with half-transparent grey
-			mini_context.set_source_rgba(0.3, 0.3, 0.3, 0.2)
-			mini_context.fill_preserve()
-
-			# Draw the paths with grey
-			mini_context.set_source_rgba(0.5, 0.5, 0.5, 1.0)
-			mini_context.stroke()
 		self._minimap_area.queue_draw()
 
+	def _draw_overlay(self, mini_context):
+		image = self._window.get_active_image()
+		if not image.get_minimap_need_overlay():
+			return
+		size_ratio = image.get_minimap_ratio(self._thumbnail.get_width())
+		mini_x = int(image.scroll_x * size_ratio)
+		mini_y = int(image.scroll_y * size_ratio)
+		visible_width, visible_height = image.get_visible_size()
+		# We add pixels because those "int" truncate a pixel on each side
+		mini_width = int(visible_width * size_ratio) + 2
+		mini_height = int(visible_height * size_ratio) + 2
+
+		# Set up the cairo context
+		mini_context.new_path()
+		mini_context.set_line_width(1)
+		mini_context.set_antialias(cairo.Antialias.NONE)
+		mini_context.set_line_cap(cairo.LineCap.SQUARE)
+
+		# Path around the visible area
+		mini_context.move_to(mini_x, mini_y)
+		mini_context.line_to(mini_x, mini_height + mini_y)
+		mini_context.line_to(mini_width + mini_x, mini_height + mini_y)
+		mini_context.line_to(mini_width + mini_x, mini_y)
+		mini_context.line_to(mini_x, mini_y)
+
+		# Path around the entire thumbnail
+		pix_width = self._thumbnail.get_width()
+		pix_height = self._thumbnail.get_height()
+		mini_context.move_to(0, 0)
+		mini_context.line_to(pix_width, 0)
+		# We add pixels because those "int" truncate a pixel on each side
+		mini_context.line_to(pix_width + 1, pix_height + 1)
+		mini_context.line_to(0, pix_height)
+		mini_context.close_path()
+
+		# Fill between these 2 paths with half-transparent grey
+		mini_context.set_source_rgba(0.3, 0.3, 0.3, 0.2)
+		mini_context.fill_preserve()
+
+		# Draw the paths with grey
+		mini_context.set_source_rgba(0.5, 0.5, 0.5, 1.0)
+		mini_context.stroke()
+
 	############################################################################
 
 	def _update_zoom_level(self, *args):
@@ -116,7 +122,7 @@ class DrMinimap(Gtk.Popover):
 		image = self._window.get_active_image()
 		if image.zoom_level != zoom_value / 100:
 			image.zoom_level = zoom_value / 100
-			image.update()
+			image.update_view()
 		self.set_zoom_label(image.zoom_level * 100)
 
 	def _on_popover_dismissed(self, *args):
@@ -127,9 +133,11 @@ class DrMinimap(Gtk.Popover):
 			pass
 
 	def _on_mm_draw(self, area, cairo_context):
-		"""Callback of the 'draw' signal, painting the area with the surface."""
-		cairo_context.set_source_surface(self._mini_surface, 0, 0)
+		"""Callback of the 'draw' signal, painting the area with the thumbnail
+		and the overlay showing the visible part of the image."""
+		cairo_context.set_source_surface(self._thumbnail, 0, 0)
 		cairo_context.paint()
+		self._draw_overlay(cairo_context)
 
 	def _on_mm_press(self, area, event):
 		"""Callback of the 'button-press-event' signal."""
@@ -145,7 +153,7 @@ class DrMinimap(Gtk.Popover):
 		image = self._window.get_active_image()
 		image.scroll_x = self._old_scroll_x
 		image.scroll_y = self._old_scroll_y
-		size_ratio = image.get_minimap_ratio(self.mini_pixbuf.get_width())
+		size_ratio = image.get_minimap_ratio(self._thumbnail.get_width())
 		delta_x = int((event.x - self._press_x) / size_ratio)
 		delta_y = int((event.y - self._press_y) / size_ratio)
 		image.add_deltas(delta_x, delta_y, 1)
@@ -32,6 +32,10 @@ class DrPrefsWindow(Gtk.Window):
 	adj_width = Gtk.Template.Child()
 	adj_height = Gtk.Template.Child()
 	adj_preview = Gtk.Template.Child()
+	adj_keyframe_ops = Gtk.Template.Child()
+	adj_keyframe_delay = Gtk.Template.Child()
+	adj_memory_budget = Gtk.Template.Child()
+	adj_global_budget = Gtk.Template.Child()
 
 	_current_grid = None
 	_grid_attach_cpt = 0
@@ -170,6 +174,24 @@ class DrPrefsWindow(Gtk.Window):
 
 		self.add_switch(_("Prefer dark theme variant"), 'dark-theme-variant')
 
+		self.add_section_separator()
+		# Context: title of a section of the preferences
+		self.add_section_title(_("History"))
+		self.add_help(_("The image is remembered automatically after some " + \
+		           "operations, so undoing doesn't have to redo all of them.") + \
+		        " " + _("Higher values use less memory, but undoing can " + \
+		                                                     "be slower."))
+		self.add_adj(_("Operations between two snapshots"), \
+		                   'history-keyframe-ops', self.adj_keyframe_ops, None)
+		self.add_adj(_("Maximum replay time (ms)"), \
+		               'history-keyframe-delay', self.adj_keyframe_delay, None)
+		self.add_adj(_("Memory for each image (MB)"), \
+		                 'history-memory-budget', self.adj_memory_budget, None)
+		self.add_adj(_("Memory for all images (MB)"), \
+		                 'history-global-budget', self.adj_global_budget, None)
+		self.add_switch(_("Move old history to the disk"), 'history-spill')
+		self.add_switch(_("Restore the history after a crash"), 'history-journal')
+
 		self.add_section_separator()
 		# Context: title of a section of the preferences. It corresponds to the
 		# window layout (header-bar? tool-bar? menu-bar?)
@@ -249,10 +271,10 @@ class DrPrefsWindow(Gtk.Window):
 		color_btn.connect('color-set', self.on_colorbtn_changed, key)
 		self.add_row(label_text, color_btn)
 
-	def add_adj(self, label_text, key, adj):
+	def add_adj(self, label_text, key, adj, unit='px'):
 		spinbtn = Gtk.SpinButton(adjustment=adj)
 		spinbtn.set_value(self._gsettings.get_int(key))
-		utilities_add_unit_to_spinbtn(spinbtn, 4, 'px')
+		utilities_add_unit_to_spinbtn(spinbtn, 4, unit)
 		spinbtn.connect('value-changed', self.on_adj_changed, key)
 		self.add_row(label_text, spinbtn)
 
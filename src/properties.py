@@ -15,7 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from gi.repository import Gtk, GdkPixbuf, Pango
+from gi.repository import Gtk, GdkPixbuf, GLib, Pango
 
 class DrPropertiesDialog(Gtk.Dialog):
 	__gtype_name__ = 'DrPropertiesDialog'
@@ -82,6 +82,8 @@ class DrPropertiesDialog(Gtk.Dialog):
 		self._add_grid_row(2, _("Colorspace"), self._set_colorspace_label())
 		# TODO display both the colorspace of the file and of the surface, with
 		# a warning if there might be a loss of data
+		# Context: the memory used by the undo/redo history of the image
+		self._add_grid_row(3, _("History memory"), self._set_memory_label())
 
 	def _add_grid_row(self, index, key, value):
 		"""Adds a row 2 labels (a key and a value) to the dialog's main grid."""
@@ -107,6 +109,15 @@ class DrPropertiesDialog(Gtk.Dialog):
 		colorspace_text = enum.get(cairo_format, _("Invalid format"))
 		return colorspace_text
 
+	def _set_memory_label(self):
+		usage = GLib.format_size(self._image.get_history_memory_usage())
+		image_budget = self._image.get_history_budgets()[0]
+		if image_budget <= 0:
+			return usage
+		# Context: the memory used by the history of the image, compared to the
+		# maximum allowed by the preferences, for example "42 MB / 512 MB"
+		return _("{0} / {1}").format(usage, GLib.format_size(image_budget))
+
 	############################################################################
 
 	def _set_size_labels(self):
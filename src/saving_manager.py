@@ -55,7 +55,7 @@ class DrSavingManager():
 		if selection_only:
 			pixbuf = image.selection.get_pixbuf()
 		else:
-			pixbuf = image.main_pixbuf
+			pixbuf = image.get_main_pixbuf()
 
 		# Ask the user what to do concerning formats with no alpha channel
 		if not allow_alpha:
@@ -138,7 +138,7 @@ class DrSavingManager():
 		save_id = dialog.set_action(_("Save"), None, True)
 		dialog.add_string( _("There are unsaved modifications to %s.") % display_name)
 		self._window.minimap.update_content()
-		image = Gtk.Image().new_from_pixbuf(self._window.minimap.mini_pixbuf)
+		image = Gtk.Image().new_from_surface(self._window.minimap.get_thumbnail())
 		frame = Gtk.Frame(valign=Gtk.Align.CENTER, halign=Gtk.Align.CENTER)
 		frame.add(image)
 		dialog.add_widget(frame)
@@ -195,7 +195,7 @@ class DrSavingManager():
 		dialog.add_string(msg)
 		dialog.add_string(_("Do you want to save anyway?"))
 		self._window.minimap.update_content()
-		image = Gtk.Image().new_from_pixbuf(self._window.minimap.mini_pixbuf)
+		image = Gtk.Image().new_from_surface(self._window.minimap.get_thumbnail())
 		frame = Gtk.Frame(valign=Gtk.Align.CENTER, halign=Gtk.Align.CENTER)
 		frame.add(image)
 		dialog.add_widget(frame)
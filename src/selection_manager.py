@@ -61,11 +61,9 @@ class DrSelectionManager():
 
 		self.selection_path = new_path
 		self.is_active = True
-		main_pixbuf = self.image.main_pixbuf
 
 		# Erase everything outside of the path
-		surface = Gdk.cairo_surface_create_from_pixbuf(main_pixbuf, 0, None)
-		surface.set_device_scale(self.image.SCALE_FACTOR, self.image.SCALE_FACTOR)
+		surface = self.image.copy_main_surface()
 		cairo_context = cairo.Context(surface)
 		cairo_context.set_operator(cairo.Operator.DEST_IN)
 		cairo_context.new_path()
@@ -74,8 +72,8 @@ class DrSelectionManager():
 		cairo_context.set_operator(cairo.Operator.OVER)
 
 		# Find the coords to reduce the size of what will be stored
-		main_width = main_pixbuf.get_width()
-		main_height = main_pixbuf.get_height()
+		main_width = self.image.get_pixbuf_width()
+		main_height = self.image.get_pixbuf_height()
 		xmin, ymin, xmax, ymax = cairo_context.path_extents()
 		xmax = min(xmax, main_width)
 		ymax = min(ymax, main_height)
@@ -253,8 +251,8 @@ class DrSelectionManager():
 			return
 		# Convert selection manager's future_path coords from absolute to
 		# relative ones, and sets future coords accordingly.
-		main_width = self.image.main_pixbuf.get_width()
-		main_height = self.image.main_pixbuf.get_height()
+		main_width = self.image.get_pixbuf_width()
+		main_height = self.image.get_pixbuf_height()
 		xmin, ymin = main_width, main_height # TODO context.path_extents() ?
 		for pts in self._future_path:
 			if pts[1] != ():
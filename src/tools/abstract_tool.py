@@ -15,7 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import cairo
+import cairo, time
 from gi.repository import Gtk, Gdk
 
 class WrongToolIdException(Exception):
@@ -49,6 +49,13 @@ class AbstractAbstractTool():
 		self._ongoing_operation = False
 		self._modifier_keys = []
 		self._last_btn = 1
+		# The last operation previewed on the canvas, its extents (computed
+		# when needed), and the area covered by the preview before it
+		self._previewed_operation = None
+		self._previewed_extents = None
+		self._preview_extents = None
+		# Area damaged by the last frame of an incremental preview
+		self._frame_extents = None
 		# Once everything is set, build the UI
 		self.try_build_pane()
 
@@ -273,11 +280,65 @@ class AbstractAbstractTool():
 	def do_tool_operation(self, operation):
 		pass
 
+	def get_operation_extents(self, operation):
+		"""Return the rectangle (x, y, width, height) of the image that can be
+		modified by the operation, or None if it's unknown. The history uses it
+		to undo the operation without replaying all the others."""
+		return None
+
 	def start_tool_operation(self, operation):
 		if operation['tool_id'] != self.id:
 			raise WrongToolIdException(operation['tool_id'], self.id)
 		self.restore_pixbuf()
 		self._ongoing_operation = True
+		self._previewed_operation = operation
+		self._previewed_extents = None
+		self._frame_extents = None
+		self.get_image().set_damaging_tool(self)
+
+	def set_previewed_operation(self, operation, extents, frame_extents):
+		"""Called by tools previewing an operation without drawing all of it:
+		`extents` is where the operation is drawn on the surface, and
+		`frame_extents` is the part of it which changed since the last frame."""
+		self._previewed_operation = operation
+		self._previewed_extents = extents
+		self._frame_extents = frame_extents
+		self.get_image().set_damaging_tool(self)
+
+	def get_previewed_extents(self):
+		"""Return the extents of the last operation started by the tool, or
+		None if they're unknown."""
+		if self._previewed_operation is None or self.selection_is_active():
+			return None
+		if self._previewed_extents is None:
+			self._previewed_extents = \
+			             self.get_operation_extents(self._previewed_operation)
+		return self._previewed_extents
+
+	def get_damaged_area(self):
+		"""Return the rectangle (x, y, width, height) of the image that has to
+		be redrawn to show the operation previewed since the last call, which
+		includes what the previous preview covered. None means the whole canvas
+		has to be redrawn."""
+		extents = self.get_previewed_extents()
+		if self._frame_extents is not None:
+			# The preview is incremental, so it can only grow
+			self._preview_extents = extents
+			frame_extents = self._frame_extents
+			self._frame_extents = None
+			return frame_extents
+		previous = self._preview_extents
+		self._preview_extents = extents
+		if extents is None or previous is None:
+			return extents
+		return self._merge_extents(extents, previous)
+
+	def _merge_extents(self, extents1, extents2):
+		x = min(extents1[0], extents2[0])
+		y = min(extents1[1], extents2[1])
+		x2 = max(extents1[0] + extents1[2], extents2[0] + extents2[2])
+		y2 = max(extents1[1] + extents1[3], extents2[1] + extents2[3])
+		return (x, y, x2 - x, y2 - y)
 
 	def apply_operation(self, operation):
 		"""Complete method to apply an operation: the operation is applied and
@@ -288,13 +349,42 @@ class AbstractAbstractTool():
 
 	def simple_apply_operation(self, operation):
 		"""Simpler apply_operation, for the 'rebuild from history' method."""
+		undo_patch = None
 		try:
+			undo_patch = self._get_undo_patch(operation)
+			time0 = time.monotonic()
 			self.do_tool_operation(operation)
-			self.get_image().add_to_history(operation)
+			# Replay cost in milliseconds, used to decide when the history
+			# should remember a keyframe
+			replay_cost = (time.monotonic() - time0) * 1000
+			self.get_image().add_to_history(operation, replay_cost, undo_patch)
 		except Exception as e:
 			self.show_error(str(e))
 		self._ongoing_operation = False
-		self.non_destructive_show_modif() # XXX nécessaire ?
+		# The area modified by the operation is covered by the undo patch, and
+		# the surface changed where the last preview was drawn too. If this
+		# area isn't known, the whole image is considered as changed.
+		damaged = None
+		if undo_patch is not None and self._preview_extents is not None:
+			x, y, patch = undo_patch
+			damaged = self._merge_extents(self._preview_extents, \
+			                   (x, y, patch.get_width(), patch.get_height()))
+		# The whole canvas is redrawn below, the next preview starts anew
+		self._previewed_operation = None
+		self._previewed_extents = None
+		self._preview_extents = None
+		self._frame_extents = None
+		self.non_destructive_show_modif(damaged) # XXX nécessaire ?
+
+	def _get_undo_patch(self, operation):
+		"""Copy the pixels of the main pixbuf that the operation is about to
+		modify, so the history can undo it by pasting them back."""
+		if self.selection_is_active():
+			return None
+		extents = self.get_operation_extents(operation)
+		if extents is None:
+			return None
+		return self.get_image().get_pixbuf_patch(*extents)
 
 	############################################################################
 	# Selection ################################################################
@@ -327,10 +417,10 @@ class AbstractAbstractTool():
 		return cairo.Context(self.get_surface())
 
 	def get_main_pixbuf(self):
-		return self.get_image().main_pixbuf
+		return self.get_image().get_main_pixbuf()
 
-	def non_destructive_show_modif(self):
-		self.get_image().update()
+	def non_destructive_show_modif(self, damaged=None):
+		self.get_image().update(damaged)
 
 	def restore_pixbuf(self):
 		self.get_image().use_stable_pixbuf()
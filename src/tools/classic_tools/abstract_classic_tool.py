@@ -18,11 +18,17 @@
 import cairo
 from .abstract_tool import AbstractAbstractTool
 from .optionsbar_classic import OptionsBarClassic
+from .stroke_layer import DrStrokeLayer
 from .utilities_colors import utilities_gdk_rgba_to_normalized_array
+from .utilities_paths import utilities_get_path_extents
 
 class AbstractClassicTool(AbstractAbstractTool):
 	__gtype_name__ = 'AbstractClassicTool'
 
+	# These operators can modify the image outside of what is drawn
+	UNBOUNDED_OPERATORS = [cairo.Operator.IN, cairo.Operator.OUT, \
+	                          cairo.Operator.DEST_IN, cairo.Operator.DEST_ATOP]
+
 	def __init__(self, tool_id, label, icon_name, window, **kwargs):
 		super().__init__(tool_id, label, icon_name, window)
 		self.menu_id = 0
@@ -40,6 +46,7 @@ class AbstractClassicTool(AbstractAbstractTool):
 		self._use_antialias = self.load_tool_action_boolean('antialias', \
 		                                                     'use-antialiasing')
 		# XXX honteusement sous-performant ^
+		self._stroke_layer = None
 
 	############################################################################
 	# UI implementations #######################################################
@@ -57,6 +64,7 @@ class AbstractClassicTool(AbstractAbstractTool):
 	def set_common_values(self, event_btn, event_x, event_y):
 		self.x_press = event_x
 		self.y_press = event_y
+		self._stroke_layer = None
 		if event_btn != self._last_btn:
 			self._set_options(event_btn)
 		self._last_btn = event_btn
@@ -122,5 +130,54 @@ class AbstractClassicTool(AbstractAbstractTool):
 			i = i + 1
 		cairo_context.set_dash(dashes_descriptor)
 
+	def can_preview_stroke(self, operator):
+		"""Tell if an operation using this operator can be previewed by
+		`preview_stroke`, otherwise the whole operation has to be drawn."""
+		return not self.selection_is_active() \
+		                            and operator not in self.UNBOUNDED_OPERATORS
+
+	def preview_stroke(self, operation, rgba, operator, line_width):
+		"""Preview an operation which looks like a polyline with round caps
+		and joins going through the 'points' of the operation (a sequence of
+		(x, y) tuples), drawing only the segments added since the previous
+		preview. The operation itself is drawn only when it's applied, so its
+		'path' can be None while it's previewed."""
+		points = operation['points']
+		image = self.get_image()
+		width = self.get_surface().get_width()
+		height = self.get_surface().get_height()
+		antialias = operation.get('antialias', True)
+		layer = self._stroke_layer
+		extents = None
+		if layer is not None \
+		and layer.accepts(points, line_width, antialias, width, height):
+			extents = layer.update(points)
+			if extents is not None and not image.restore_surface_area(extents, self):
+				layer = None
+		else:
+			layer = None
+
+		if layer is None:
+			# The whole stroke has to be drawn on a restored surface
+			self.restore_pixbuf()
+			layer = DrStrokeLayer(width, height, line_width, antialias)
+			self._stroke_layer = layer
+			extents = layer.update(points)
+
+		if extents is not None:
+			layer.paint_on(self.get_context(), points, extents, rgba, operator)
+		self._ongoing_operation = True
+		self.set_previewed_operation(operation, layer.extents, extents)
+
+	def get_path_extents(self, operation, margin, smooth=False):
+		"""Helper for the implementations of `get_operation_extents` by tools
+		whose operations draw their 'path' (as a cairo.Path)."""
+		if operation['path'] is None:
+			return None
+		if operation.get('operator', None) in self.UNBOUNDED_OPERATORS:
+			return None
+		# the additional pixel is for the antialiasing
+		return utilities_get_path_extents(operation['path'], margin + 1, smooth)
+
 	############################################################################
 ################################################################################
@@ -14,6 +14,11 @@ class AbstractBrush():
 
 	############################################################################
 
+	def get_preview_width(self, operation):
+		"""Return the line width of the preview if it's a polyline with round
+		caps and joins, which the tool can then draw segment by segment."""
+		return None
+
 	def draw_preview(self, operation, cairo_context):
 		cairo_context.set_operator(operation['operator'])
 		cairo_context.set_line_width(operation['line_width'])
@@ -16,6 +16,9 @@ class BrushSimple(AbstractBrush):
 			label += _("Width depends on the mouse speed")
 		return [label]
 
+	def get_preview_width(self, operation):
+		return max(1, int(operation['line_width'] * 0.8))
+
 	def draw_preview(self, operation, cairo_context):
 		cairo_context.set_line_cap(cairo.LineCap.ROUND)
 		cairo_context.set_line_join(cairo.LineJoin.ROUND)
@@ -31,7 +34,7 @@ class BrushSimple(AbstractBrush):
 		make it less ugly)."""
 
 		if operation['is_preview']: # Previewing helps performance & debug
-			operation['line_width'] = max(1, int(operation['line_width'] * 0.8))
+			operation['line_width'] = self.get_preview_width(operation)
 			return self.draw_preview(operation, cairo_context)
 
 		if len(operation['path']) < 3:
@@ -23,6 +23,14 @@ class AbstractEraser():
 	def on_release(self, cairo_context, press, event, path=None):
 		return None
 
+	def get_operation_path(self, path):
+		"""Return what the operation stores as its path, from the object built
+		by `on_motion` and `on_release`."""
+		return path
+
+	def get_operation_extents(self, operation):
+		return None
+
 	def do_operation(self, cairo_context, operation):
 		pass
 
@@ -2,6 +2,7 @@
 
 import cairo, random
 from .abstract_eraser import AbstractEraser
+from .utilities_paths import utilities_get_path_extents
 from .utilities_blur import utilities_blur_surface, BlurType, BlurDirection
 
 class EraserArea(AbstractEraser):
@@ -41,6 +42,9 @@ class EraserArea(AbstractEraser):
 
 	############################################################################
 
+	def get_operation_extents(self, operation):
+		return utilities_get_path_extents(operation['path'], 2)
+
 	def do_operation(self, cairo_context, operation):
 		cairo_context.set_operator(cairo.Operator.SOURCE)
 		censor_type = operation['censor-type']
@@ -70,7 +74,7 @@ class EraserArea(AbstractEraser):
 		if censor_type == 'mosaic':
 			bs = utilities_blur_surface(surface, b_rad, BlurType.TILES, b_dir)
 		elif censor_type == 'blur':
-			bs = utilities_blur_surface(surface, b_rad, BlurType.PX_BOX, b_dir)
+			bs = utilities_blur_surface(surface, b_rad, BlurType.AUTO, b_dir)
 		elif censor_type == 'shuffle':
 			bs = self._shuffle_pixels(surface, shuffle_intensity)
 		elif censor_type == 'mixed':
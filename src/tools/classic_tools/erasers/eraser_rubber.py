@@ -2,6 +2,8 @@
 
 import cairo
 from .abstract_eraser import AbstractEraser
+from .stroke_layer import DrPointBuffer
+from .utilities_paths import utilities_get_path_extents
 
 class EraserRubber(AbstractEraser):
 	__gtype_name__ = 'EraserRubber'
@@ -26,14 +28,22 @@ class EraserRubber(AbstractEraser):
 
 	def on_release(self, cairo_context, press, event, path=None):
 		if path is None:
-			cairo_context.move_to(*press)
-		else:
-			cairo_context.append_path(path)
-		cairo_context.line_to(*event)
-		return cairo_context.copy_path()
+			path = DrPointBuffer()
+			path.append(*press)
+		path.append(*event)
+		return path
+
+	def get_operation_path(self, path):
+		if path is None:
+			return None
+		return path.to_path()
 
 	############################################################################
 
+	def get_operation_extents(self, operation):
+		return utilities_get_path_extents(operation['path'], \
+		                                          operation['line_width'] + 1)
+
 	def do_operation(self, cairo_context, operation):
 		cairo_context.set_operator(cairo.Operator.SOURCE)
 		cairo_context.set_source_rgba(*operation['replacement'])
@@ -0,0 +1,197 @@
+# Licensed under GPL3 https://github.com/maoschanz/drawing/blob/master/LICENSE
+
+import array, cairo
+
+################################################################################
+
+class DrPointBuffer():
+	"""Growable list of the points of a stroke being drawn, stored as pairs
+	of floats in an array, so adding a point is cheap and doesn't copy the
+	previous ones. The cairo path is built only when an operation needs it.
+	Only the last point can be modified after it has been added."""
+	__gtype_name__ = 'DrPointBuffer'
+
+	def __init__(self, **kwargs):
+		self._coords = array.array('d')
+		# Context where the path is built, and how many points it contains
+		self._context = None
+		self._in_context = 0
+		# Last path returned, until a point is added or modified
+		self._path = None
+
+	def __len__(self):
+		return len(self._coords) // 2
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return [self[i] for i in range(*index.indices(len(self)))]
+		if index < 0:
+			index += len(self)
+		if index < 0 or index >= len(self):
+			raise IndexError(index)
+		return (self._coords[2 * index], self._coords[2 * index + 1])
+
+	def append(self, x, y):
+		self._coords.append(x)
+		self._coords.append(y)
+		self._path = None
+
+	def set_last(self, x, y):
+		self._coords[-2] = x
+		self._coords[-1] = y
+		self._path = None
+		if self._in_context == len(self):
+			# the old position of the point is already in the path, which
+			# has to be built again
+			self._context = None
+			self._in_context = 0
+
+	def to_path(self):
+		"""Return the points as a cairo.Path made of lines, or None if there
+		is no point. Only the points added since the previous call are added
+		to the path, which is copied once."""
+		length = len(self)
+		if length == 0:
+			return None
+		if self._path is not None:
+			return self._path
+		if self._context is None:
+			surface = cairo.ImageSurface(cairo.Format.A8, 1, 1)
+			self._context = cairo.Context(surface)
+		while self._in_context < length:
+			x, y = self[self._in_context]
+			if self._in_context == 0:
+				self._context.move_to(x, y)
+			else:
+				self._context.line_to(x, y)
+			self._in_context += 1
+		self._path = self._context.copy_path()
+		return self._path
+
+	############################################################################
+################################################################################
+
+class DrStrokeLayer():
+	"""Coverage of a stroke being drawn, as a polyline with round caps and
+	joins. Each segment is rasterized on this layer once, as soon as the point
+	ending it can't change anymore, so the cost of a preview frame depends on
+	the length of the new segments, not on the length of the whole stroke.
+	The last segment is drawn again at each frame, because tools such as the
+	highlighter may still move its end."""
+	__gtype_name__ = 'DrStrokeLayer'
+
+	def __init__(self, width, height, line_width, antialias, **kwargs):
+		self._surface = cairo.ImageSurface(cairo.Format.A8, width, height)
+		self._line_width = line_width
+		self._antialias = antialias
+		# Number of points whose segments are rasterized, and the last of them
+		self._committed = 0
+		self._last_point = None
+		self._tail_extents = None
+		# Extents of everything drawn by the layer, in the image coordinates
+		self.extents = None
+
+	def accepts(self, points, line_width, antialias, width, height):
+		"""Tell if the layer can continue the stroke described by `points`,
+		which has to start with the points already rasterized."""
+		if line_width != self._line_width or antialias != self._antialias:
+			return False
+		if width != self._surface.get_width() \
+		or height != self._surface.get_height():
+			return False
+		if len(points) < self._committed:
+			return False
+		if self._committed == 0:
+			return True
+		return tuple(points[self._committed - 1]) == self._last_point
+
+	def update(self, points):
+		"""Rasterize the segments which end before the last point, and return
+		the area (x, y, width, height) which changed since the previous call,
+		or None if it's empty."""
+		damaged = self._tail_extents
+		last_index = len(points) - 1
+		if last_index > self._committed:
+			new_points = points[max(0, self._committed - 1):last_index]
+			self._stroke_polyline(self._get_context(), new_points)
+			damaged = self._merge(damaged, self._get_extents(new_points))
+			self._committed = last_index
+			self._last_point = tuple(points[last_index - 1])
+		self._tail_extents = self._get_extents(points[max(0, last_index - 1):])
+		damaged = self._merge(damaged, self._tail_extents)
+		self.extents = self._merge(self.extents, damaged)
+		return damaged
+
+	def paint_on(self, cairo_context, points, extents, rgba, operator):
+		"""Composite the stroke (the rasterized segments and the last one) in
+		the given area of the context, as if the whole polyline was stroked
+		with this color and operator."""
+		x, y, width, height = extents
+		mask = cairo.ImageSurface(cairo.Format.A8, width, height)
+		mask_context = cairo.Context(mask)
+		mask_context.set_source_surface(self._surface, -1 * x, -1 * y)
+		mask_context.paint()
+		mask_context.translate(-1 * x, -1 * y)
+		self._stroke_polyline(mask_context, points[max(0, len(points) - 2):])
+
+		cairo_context.save()
+		cairo_context.rectangle(x, y, width, height)
+		cairo_context.clip()
+		cairo_context.set_operator(operator)
+		cairo_context.set_source_rgba(*rgba)
+		cairo_context.mask_surface(mask, x, y)
+		cairo_context.restore()
+
+	############################################################################
+
+	def _get_context(self):
+		return cairo.Context(self._surface)
+
+	def _stroke_polyline(self, cairo_context, points):
+		if len(points) == 0:
+			return
+		if self._antialias:
+			cairo_context.set_antialias(cairo.Antialias.DEFAULT)
+		else:
+			cairo_context.set_antialias(cairo.Antialias.NONE)
+		cairo_context.set_line_cap(cairo.LineCap.ROUND)
+		cairo_context.set_line_join(cairo.LineJoin.ROUND)
+		cairo_context.set_line_width(self._line_width)
+		cairo_context.move_to(*points[0])
+		# a single point is drawn as a dot, thanks to the round caps
+		cairo_context.line_to(*points[0])
+		for point in points[1:]:
+			cairo_context.line_to(*point)
+		cairo_context.stroke()
+
+	def _get_extents(self, points):
+		if len(points) == 0:
+			return None
+		# the additional pixel is for the antialiasing
+		margin = self._line_width / 2 + 1
+		x1 = int(min(p[0] for p in points) - margin)
+		y1 = int(min(p[1] for p in points) - margin)
+		x2 = int(max(p[0] for p in points) + margin) + 1
+		y2 = int(max(p[1] for p in points) + margin) + 1
+		x1 = max(0, x1)
+		y1 = max(0, y1)
+		x2 = min(self._surface.get_width(), x2)
+		y2 = min(self._surface.get_height(), y2)
+		if x2 <= x1 or y2 <= y1:
+			return None
+		return (x1, y1, x2 - x1, y2 - y1)
+
+	def _merge(self, extents1, extents2):
+		if extents1 is None:
+			return extents2
+		if extents2 is None:
+			return extents1
+		x = min(extents1[0], extents2[0])
+		y = min(extents1[1], extents2[1])
+		x2 = max(extents1[0] + extents1[2], extents2[0] + extents2[2])
+		y2 = max(extents1[1] + extents1[3], extents2[1] + extents2[3])
+		return (x, y, x2 - x, y2 - y)
+
+	############################################################################
+################################################################################
+
@@ -17,6 +17,7 @@
 
 from gi.repository import Gdk
 from .abstract_classic_tool import AbstractClassicTool
+from .utilities_paths import utilities_get_points_extents
 
 from .brush_simple import BrushSimple
 from .brush_airbrush import BrushAirbrush
@@ -30,6 +31,7 @@ class ToolBrush(AbstractClassicTool):
 		super().__init__('brush', _("Brush"), 'tool-brush-symbolic', window)
 		self.use_operator = True
 		self._used_pressure = False
+		self._points = []
 
 		self._brushes_dict = {
 			'simple': BrushSimple('simple', self),
@@ -64,14 +66,24 @@ class ToolBrush(AbstractClassicTool):
 	def on_press_on_area(self, event, surface, event_x, event_y):
 		self.set_common_values(event.button, event_x, event_y)
 		self._manual_path = []
+		self._points = []
 		self._add_pressured_point(event_x, event_y, event)
 		self._used_pressure = self._manual_path[0]['p'] is not None
 
 	def on_motion_on_area(self, event, surface, event_x, event_y, render=True):
 		self._add_pressured_point(event_x, event_y, event)
-		if render:
-			operation = self.build_operation()
+		if not render:
+			return
+		operation = self.build_operation()
+		active_brush = self._brushes_dict[operation['brush_id']]
+		preview_width = active_brush.get_preview_width(operation)
+		if preview_width is None \
+		or not self.can_preview_stroke(operation['operator']):
 			self.do_tool_operation(operation)
+		else:
+			operation['points'] = self._points
+			self.preview_stroke(operation, operation['rgba'], \
+			                             operation['operator'], preview_width)
 
 	def on_release_on_area(self, event, surface, event_x, event_y):
 		self._add_pressured_point(event_x, event_y, event)
@@ -88,6 +100,7 @@ class ToolBrush(AbstractClassicTool):
 			'p': self._get_pressure(event)
 		}
 		self._manual_path.append(new_point)
+		self._points.append((event_x, event_y))
 
 	def _get_pressure(self, event):
 		device = event.get_source_device()
@@ -128,6 +141,13 @@ class ToolBrush(AbstractClassicTool):
 		}
 		return operation
 
+	def get_operation_extents(self, operation):
+		if operation['operator'] in self.UNBOUNDED_OPERATORS:
+			return None
+		# the brushes may draw up to the line width around the points
+		return utilities_get_points_extents(operation['path'], \
+		                                          operation['line_width'] + 2)
+
 	def do_tool_operation(self, operation):
 		if operation['path'] is None or len(operation['path']) < 1:
 			return
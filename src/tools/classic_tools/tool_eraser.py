@@ -130,8 +130,14 @@ class ToolEraser(AbstractClassicTool):
 
 		if not render:
 			return
-		operation = self.build_operation(True)
-		self.do_tool_operation(operation)
+		if self._eraser_shape == 'rubber' \
+		and self.can_preview_stroke(cairo.Operator.SOURCE):
+			# the rubber eraser's "path" is the buffer of the pointer positions
+			operation = self.build_operation(True, True)
+			self.preview_stroke(operation, operation['replacement'], \
+			                    cairo.Operator.SOURCE, operation['line_width'])
+		else:
+			self.do_tool_operation(self.build_operation(True))
 
 	def on_release_on_area(self, event, surface, event_x, event_y):
 		cairo_context = self.get_context()
@@ -148,7 +154,9 @@ class ToolEraser(AbstractClassicTool):
 
 	############################################################################
 
-	def build_operation(self, is_preview):
+	def build_operation(self, is_preview, with_points=False):
+		"""If `with_points` is true, the operation of the rubber eraser has the
+		buffer of 'points' instead of the cairo path."""
 		if is_preview:
 			eraser_type = 'solid'
 		else:
@@ -161,10 +169,20 @@ class ToolEraser(AbstractClassicTool):
 			'censor-type': eraser_type,
 			'censor-shape': self._eraser_shape,
 			'antialias': self._use_antialias,
-			'path': self._path
 		}
+		if with_points:
+			operation['path'] = None
+			operation['points'] = self._path
+		else:
+			operation['path'] = self.get_eraser().get_operation_path(self._path)
 		return operation
 
+	def get_operation_extents(self, operation):
+		if operation['path'] is None:
+			return None
+		eraser_id = operation['censor-shape']
+		return self._erasers[eraser_id].get_operation_extents(operation)
+
 	def do_tool_operation(self, operation):
 		# depending on the implementation, the "path" might not be a cairo.Path
 		if operation['path'] is None:
@@ -18,6 +18,7 @@
 import cairo
 from .tool_pencil import ToolPencil
 from .abstract_classic_tool import AbstractClassicTool
+from .stroke_layer import DrPointBuffer
 
 class ToolHighlighter(ToolPencil):
 	__gtype_name__ = 'ToolHighlighter'
@@ -28,7 +29,7 @@ class ToolHighlighter(ToolPencil):
 		AbstractClassicTool.__init__(self, 'highlight', _("Highlighter"), \
 		                                      'tool-highlight-symbolic', window)
 		self.use_operator = False
-		self._path = None
+		self._points = DrPointBuffer()
 		self.add_tool_action_boolean('highlight-alpha', True)
 		self.add_tool_action_boolean('highlight-rigid', True)
 		self.add_tool_action_enum('highlight-bg', 'light')
@@ -63,7 +64,8 @@ class ToolHighlighter(ToolPencil):
 
 	def on_press_on_area(self, event, surface, event_x, event_y):
 		self.set_common_values(event.button, event_x, event_y)
-		self._path = None
+		self._points = DrPointBuffer()
+		self._points.append(event_x, event_y)
 
 		self.update_modifier_state(event.state)
 		if 'SHIFT' in self._modifier_keys:
@@ -73,31 +75,13 @@ class ToolHighlighter(ToolPencil):
 				self._bg_type = 'light'
 
 	def _add_point(self, event_x, event_y):
-		cairo_context = self.get_context()
-		if self._path is None:
-			cairo_context.move_to(self.x_press, self.y_press)
-		elif self._didnt_really_move(cairo_context, event_x, event_y):
-			length = -1
-			for pts in self._path:
-				if pts[1] == ():
-					continue
-				length += 1
-				# a better technique to find the length probably exists
-			for index, pts in enumerate(self._path):
-				if pts[1] == ():
-					continue
-				if pts[0] == cairo.PathDataType.MOVE_TO:
-					cairo_context.move_to(pts[1][0], pts[1][1])
-				elif index == length:
-					event_x = (pts[1][0] + event_x) / 2
-					event_y = (pts[1][1] + event_y) / 2
-					break
-				else: # if pts[0] == cairo.PathDataType.LINE_TO:
-					cairo_context.line_to(pts[1][0], pts[1][1])
-		cairo_context.line_to(event_x, event_y)
-		self._path = cairo_context.copy_path()
-
-	def _didnt_really_move(self, cairo_context, event_x, event_y):
+		if self._didnt_really_move(event_x, event_y):
+			last_x, last_y = self._points[-1]
+			self._points.set_last((last_x + event_x) / 2, (last_y + event_y) / 2)
+		else:
+			self._points.append(event_x, event_y)
+
+	def _didnt_really_move(self, event_x, event_y):
 		"""Tells if the pointer has moved enough to add a new point, otherwise
 		the last point will be changed.
 		It's an option that can be disabled.
@@ -105,25 +89,30 @@ class ToolHighlighter(ToolPencil):
 		assume the underlying text is written horizontally, and in straight
 		lines; so the highlighting will also be straight, but the chosen line
 		may change during the stroke."""
-		cairo_context.append_path(self._path)
-		if not self._is_rigid:
+		if not self._is_rigid or len(self._points) < 2:
+			# the point where the stroke started is never changed
 			return False
 
+		last_x, last_y = self._points[-1]
 		rigidity = min(self.tool_width, 10.0)
-		if abs(cairo_context.get_current_point()[0] - event_x) > rigidity:
+		if abs(last_x - event_x) > rigidity:
 			return False
-		if abs(cairo_context.get_current_point()[1] - event_y) > rigidity / 5:
+		if abs(last_y - event_y) > rigidity / 5:
 			return False
-
-		cairo_context.new_path()
 		return True
 
 	def on_motion_on_area(self, event, surface, event_x, event_y, render=True):
 		self._add_point(event_x, event_y)
 		if not render:
 			return
-		operation = self.build_operation()
-		self.do_tool_operation(operation)
+		operation = self.build_operation(True)
+		operator = self._get_highlight_operator(operation)
+		if not self.can_preview_stroke(operator):
+			self.do_tool_operation(self.build_operation())
+			return
+		# The preview has round ends, the applied operation has square ends
+		self.preview_stroke(operation, self._get_highlight_rgba(operation), \
+		                                            operator, operation['width'])
 
 	def on_release_on_area(self, event, surface, event_x, event_y):
 		self._add_point(event_x, event_y)
@@ -132,17 +121,27 @@ class ToolHighlighter(ToolPencil):
 
 	############################################################################
 
-	def build_operation(self):
+	def build_operation(self, with_points=False):
+		"""If `with_points` is true, the operation has the buffer of 'points'
+		instead of the cairo path, which is built only when it's applied."""
 		operation = {
 			'tool_id': self.id,
 			'rgba': self.main_color,
 			'width': self.tool_width,
-			'path': self._path,
 			'bg-type': self._bg_type,
 			'halpha': self._force_alpha
 		}
+		if with_points:
+			operation['path'] = None
+			operation['points'] = self._points
+		else:
+			operation['path'] = self._points.to_path()
 		return operation
 
+	def get_operation_extents(self, operation):
+		# square caps and round joins, so no spikes
+		return self.get_path_extents(operation, operation['width'])
+
 	def do_tool_operation(self, operation):
 		self.start_tool_operation(operation)
 		if operation['path'] is None:
@@ -152,19 +151,23 @@ class ToolHighlighter(ToolPencil):
 		ccontext.set_line_join(cairo.LineJoin.ROUND)
 		ccontext.set_line_width(operation['width'])
 
+		ccontext.set_operator(self._get_highlight_operator(operation))
+		ccontext.set_source_rgba(*self._get_highlight_rgba(operation))
+
+		ccontext.append_path(operation['path'])
+		ccontext.stroke()
+
+	def _get_highlight_operator(self, operation):
 		if operation['bg-type'] == 'light':
-			operator = cairo.Operator.MULTIPLY
+			return cairo.Operator.MULTIPLY
 		else:
-			operator = cairo.Operator.SCREEN
-		ccontext.set_operator(operator)
+			return cairo.Operator.SCREEN
 
+	def _get_highlight_rgba(self, operation):
 		main_color = operation['rgba']
 		if operation['halpha']:
 			main_color[3] = 0.5
-		ccontext.set_source_rgba(*main_color)
-
-		ccontext.append_path(operation['path'])
-		ccontext.stroke()
+		return main_color
 
 	############################################################################
 ################################################################################
@@ -86,6 +86,12 @@ class ToolPaint(AbstractClassicTool):
 		}
 		return operation
 
+	def get_operation_extents(self, operation):
+		if operation['algo'] == 'fill':
+			return self.get_path_extents(operation, 1)
+		# the other algorithms can modify the whole image
+		return None
+
 	def do_tool_operation(self, operation):
 		self.start_tool_operation(operation) # XXX expose antialiasing option?
 
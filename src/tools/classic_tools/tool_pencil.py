@@ -17,6 +17,7 @@
 
 import cairo, math
 from .abstract_classic_tool import AbstractClassicTool
+from .stroke_layer import DrPointBuffer
 from .utilities_paths import utilities_smooth_path
 
 class ToolPencil(AbstractClassicTool):
@@ -26,7 +27,7 @@ class ToolPencil(AbstractClassicTool):
 		super().__init__('pencil', _("Pencil"), 'tool-pencil-symbolic', window)
 		self.use_operator = True
 
-		self._path = None
+		self._points = DrPointBuffer()
 		self._shape_label = _("Round")
 		self._cap_id = cairo.LineCap.ROUND
 		self._join_id = cairo.LineCap.ROUND
@@ -79,27 +80,29 @@ class ToolPencil(AbstractClassicTool):
 
 	def on_press_on_area(self, event, surface, event_x, event_y):
 		self.set_common_values(event.button, event_x, event_y)
-		self._path = None
+		self._points = DrPointBuffer()
+		self._points.append(event_x, event_y)
 
 		self.update_modifier_state(event.state)
 		if 'ALT' in self._modifier_keys:
 			self._use_outline = not self._use_outline
 
 	def _add_point(self, event_x, event_y):
-		cairo_context = self.get_context()
-		if self._path is None:
-			cairo_context.move_to(self.x_press, self.y_press)
-		else:
-			cairo_context.append_path(self._path)
-		cairo_context.line_to(event_x, event_y)
-		self._path = cairo_context.copy_path()
+		self._points.append(event_x, event_y)
 
 	def on_motion_on_area(self, event, surface, event_x, event_y, render=True):
 		self._add_point(event_x, event_y)
 		if not render:
 			return
-		operation = self.build_operation()
-		self.do_tool_operation(operation)
+		operation = self.build_operation(True)
+		if operation['dashes'] != 'none' or operation['outline'] \
+		or operation['line_cap'] != cairo.LineCap.ROUND \
+		or not self.can_preview_stroke(operation['operator']):
+			# the stroke can't be drawn segment by segment
+			self.do_tool_operation(self.build_operation())
+		else:
+			self.preview_stroke(operation, operation['rgba'], \
+			                  operation['operator'], operation['line_width'])
 
 	def on_release_on_area(self, event, surface, event_x, event_y):
 		self._add_point(event_x, event_y)
@@ -125,7 +128,9 @@ class ToolPencil(AbstractClassicTool):
 
 	############################################################################
 
-	def build_operation(self):
+	def build_operation(self, with_points=False):
+		"""If `with_points` is true, the operation has the buffer of 'points'
+		instead of the cairo path, which is built only when it's applied."""
 		operation = {
 			'tool_id': self.id,
 			'rgba': self.main_color,
@@ -138,10 +143,26 @@ class ToolPencil(AbstractClassicTool):
 			'line_cap': self._cap_id,
 			'line_join': self._join_id,
 			'dashes': self._dashes_type,
-			'path': self._path
 		}
+		if with_points:
+			operation['path'] = None
+			operation['points'] = self._points
+		else:
+			operation['path'] = self._points.to_path()
 		return operation
 
+	def get_operation_extents(self, operation):
+		line_width = operation['line_width']
+		if operation['outline']:
+			line_width = line_width * 1.2 + 2
+		if operation['line_join'] == cairo.LineJoin.MITER:
+			# with the default miter limit, the spikes of the joins can be up to
+			# 10 times longer than the half of the line width
+			margin = line_width * 5
+		else:
+			margin = line_width
+		return self.get_path_extents(operation, margin, operation['smooth'])
+
 	def do_tool_operation(self, operation):
 		if operation['path'] is None:
 			return
@@ -349,6 +349,14 @@ class ToolShape(AbstractClassicTool):
 		cairo_context.set_source_rgba(*color)
 		cairo_context.fill_preserve()
 
+	def get_operation_extents(self, operation):
+		line_width = operation['line_width']
+		if operation['line_join'] == cairo.LineJoin.MITER:
+			margin = line_width * 5
+		else:
+			margin = line_width
+		return self.get_path_extents(operation, margin, operation['smooth'])
+
 	def do_tool_operation(self, operation):
 		cairo_context = self.start_tool_operation(operation)
 
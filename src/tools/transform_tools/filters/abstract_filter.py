@@ -22,6 +22,9 @@ class AbstractFilter():
 	def do_filter_operation(self, source_pixbuf, operation):
 		pass
 
+	def on_tool_unselected(self):
+		pass
+
 	############################################################################
 ################################################################################
 
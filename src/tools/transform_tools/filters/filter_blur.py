@@ -2,7 +2,7 @@
 
 from gi.repository import Gdk
 from .abstract_filter import AbstractFilter
-from .utilities_blur import utilities_blur_surface, BlurType, BlurDirection
+from .utilities_blur import BlurCache, BlurType, BlurDirection
 
 class FilterBlur(AbstractFilter):
 	__gtype_name__ = 'FilterBlur'
@@ -13,6 +13,7 @@ class FilterBlur(AbstractFilter):
 		self._label, self._spinbtn = self._tool.bar.add_spinbtn( \
 		                        _("Blur radius"), [5, 1, 99, 1, 10, 0], 2, 'px')
 		# it's [value, lower, upper, step_increment, page_increment, page_size]
+		self._blur_cache = BlurCache()
 
 	def get_preferred_minimum_width(self):
 		return self._label.get_preferred_width()[0] + \
@@ -48,14 +49,21 @@ class FilterBlur(AbstractFilter):
 		b_radius = operation['radius']
 		b_direction = operation['blur_direction']
 
-		surface = Gdk.cairo_surface_create_from_pixbuf(source_pixbuf, 0, None)
-		scale = self._tool.scale_factor()
-		surface.set_device_scale(scale, scale)
+		# the previews blur the same pixbuf again and again, and applying the
+		# operation blurs it once more, so what was computed is reused
+		if not self._blur_cache.is_source(source_pixbuf):
+			surface = Gdk.cairo_surface_create_from_pixbuf(source_pixbuf, 0, None)
+			scale = self._tool.scale_factor()
+			surface.set_device_scale(scale, scale)
+			self._blur_cache.set_source(source_pixbuf, surface)
 
-		bs = utilities_blur_surface(surface, b_radius, blur_algo, b_direction)
+		bs = self._blur_cache.blur(b_radius, blur_algo, b_direction)
 		bp = Gdk.pixbuf_get_from_surface(bs, 0, 0, bs.get_width(), bs.get_height())
 		self._tool.get_image().set_temp_pixbuf(bp)
 
+	def on_tool_unselected(self):
+		self._blur_cache.set_source(None, None)
+
 	############################################################################
 ################################################################################
 
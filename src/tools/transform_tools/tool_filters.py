@@ -98,8 +98,8 @@ class ToolFilters(AbstractCanvasTool):
 			self.type_label =  _("Fast blur")
 			self._active_filter = 'blur'
 		elif state_as_string == 'blur_slow':
-			self.blur_algo = BlurType.PX_BOX
-			self.type_label = _("Slow blur")
+			self.blur_algo = BlurType.AUTO
+			self.type_label = _("Gaussian blur")
 			self._active_filter = 'blur'
 		elif state_as_string == 'tiles':
 			self.blur_algo = BlurType.TILES
@@ -150,6 +150,11 @@ class ToolFilters(AbstractCanvasTool):
 			# the user explicitly clicks on the canvas to preview
 			self.do_tool_operation(operation)
 
+	def on_tool_unselected(self, *args):
+		super().on_tool_unselected()
+		for f in self._all_filters.values():
+			f.on_tool_unselected()
+
 	def _async_open_menu(self, *args):
 		"""This is used as a GSourceFunc so it should return False."""
 		self.bar.menu_btn.set_active(True)
@@ -1,6 +1,10 @@
 # Licensed under GPL3 https://github.com/maoschanz/drawing/blob/master/LICENSE
 
-import cairo, threading
+import cairo, concurrent.futures, math, os
+try:
+	import numpy
+except ImportError:
+	numpy = None # the blur types using it fall back to BlurType.PX_BOX
 # from datetime import datetime # Not actually needed, just to measure perfs
 
 class BlurType(int):
@@ -10,6 +14,8 @@ class BlurType(int):
 	PX_BOX_MULTI = 2
 	CAIRO_REPAINTS = 3
 	TILES = 4
+	NP_BOX = 5
+	GAUSSIAN = 6
 
 class BlurDirection(int):
 	INVALID = -1
@@ -30,16 +36,16 @@ def utilities_blur_surface(surface, radius, blur_type, blur_direction):
 	# time0 = datetime.now()
 	# print('blurring begins, using algo ', blur_type, '-', blur_direction)
 
+	blur_type = _get_actual_blur_type(blur_type)
 	if blur_type == BlurType.INVALID:
 		return surface
-	elif blur_type == BlurType.AUTO:
-		blur_type = BlurType.PX_BOX
-		# XXX c'est nul ça mdr, mais bon c'est peu utilisé
 
-	if blur_type == BlurType.PX_BOX:
+	if blur_type == BlurType.GAUSSIAN:
+		blurred_surface = _generic_gaussian_blur(surface, radius, blur_direction)
+	elif blur_type == BlurType.NP_BOX:
+		blurred_surface = _generic_np_box_blur(surface, radius, blur_direction)
+	elif blur_type == BlurType.PX_BOX:
 		blurred_surface = _generic_px_box_blur(surface, radius, blur_direction)
-	elif blur_type == BlurType.PX_BOX_MULTI:
-		blurred_surface = _generic_multi_threaded_blur(surface, radius, blur_direction)
 	elif blur_type == BlurType.CAIRO_REPAINTS:
 		blurred_surface = _generic_cairo_blur(surface, radius, blur_direction)
 	elif blur_type == BlurType.TILES:
@@ -49,6 +55,235 @@ def utilities_blur_surface(surface, radius, blur_type, blur_direction):
 	# print('blurring ended, total time:', time1 - time0)
 	return blurred_surface
 
+def _get_actual_blur_type(blur_type):
+	if blur_type == BlurType.AUTO:
+		blur_type = BlurType.GAUSSIAN
+	elif blur_type == BlurType.PX_BOX_MULTI:
+		# the numpy passes already use several threads
+		blur_type = BlurType.NP_BOX
+	if blur_type in (BlurType.NP_BOX, BlurType.GAUSSIAN) and numpy is None:
+		blur_type = BlurType.PX_BOX
+	return blur_type
+
+def _copy_surface(surface):
+	"""Return a copy of `surface` in the ARGB32 format, with the same pixels."""
+	new_surface = cairo.ImageSurface(cairo.Format.ARGB32, \
+	                               surface.get_width(), surface.get_height())
+	new_surface.set_device_scale(*surface.get_device_scale())
+	cairo_context = cairo.Context(new_surface)
+	cairo_context.set_operator(cairo.Operator.SOURCE)
+	cairo_context.set_source_surface(surface, 0, 0)
+	cairo_context.paint()
+	new_surface.flush()
+	return new_surface
+
+################################################################################
+
+class BlurCache():
+	"""Keeps what was computed to blur a surface, so it can be blurred again
+	with other parameters without starting from scratch: the last blurred
+	surface, and the last surface blurred only horizontally (the vertical
+	passes are done after it, so a change of the direction reuses it). It's
+	used by the previews of the blur filter, which blurs the same image again
+	at each change. It never keeps more than 3 surfaces of the image's size."""
+
+	def __init__(self):
+		self.set_source(None, None)
+
+	def is_source(self, source):
+		return source is self._source
+
+	def set_source(self, source, surface):
+		"""Forget what was computed, and use `surface` from now on. The cache
+		keeps it, so it must not be modified afterwards. The `source` is any
+		object having the same pixels as `surface` as long as it exists, such
+		as a pixbuf, which is never modified."""
+		self._source = source
+		if surface is not None and surface.get_format() != cairo.Format.ARGB32:
+			surface = _copy_surface(surface)
+		self._surface = surface
+		# tuples (key, surface) of the last computations
+		self._result = None
+		self._horizontal = None
+
+	def blur(self, radius, blur_type, blur_direction):
+		"""Same as `utilities_blur_surface` on the surface of the source, but
+		the returned surface must not be modified."""
+		radius = int(radius)
+		blur_type = _get_actual_blur_type(blur_type)
+		if radius < 1 or blur_type == BlurType.INVALID:
+			return self._surface
+		key = (radius, blur_type, blur_direction)
+		if self._result is not None and self._result[0] == key:
+			return self._result[1]
+		# the previous result isn't used anymore, its memory can be released
+		# before the new one is allocated
+		self._result = None
+		if blur_type in (BlurType.NP_BOX, BlurType.GAUSSIAN):
+			radii = _get_np_blur_radii(radius, blur_type)
+			blurred_surface = self._np_blur(radius, blur_type, radii, \
+			                                                  blur_direction)
+		else:
+			# some of these algorithms modify the surface they're given
+			blurred_surface = utilities_blur_surface( \
+			     _copy_surface(self._surface), radius, blur_type, blur_direction)
+		self._result = (key, blurred_surface)
+		return blurred_surface
+
+	def _np_blur(self, radius, blur_type, radii, blur_direction):
+		if blur_direction == BlurDirection.HORIZONTAL:
+			return self._get_horizontal(radius, blur_type, radii)
+		if blur_direction == BlurDirection.VERTICAL:
+			blurred_surface = _copy_surface(self._surface)
+		else:
+			horizontal = self._get_horizontal(radius, blur_type, radii)
+			blurred_surface = _copy_surface(horizontal)
+		pixels = _get_np_pixels(blurred_surface)
+		for box_radius in radii:
+			_np_box_blur_pass(pixels, box_radius, 0)
+		blurred_surface.mark_dirty()
+		return blurred_surface
+
+	def _get_horizontal(self, radius, blur_type, radii):
+		key = (radius, blur_type)
+		if self._horizontal is not None and self._horizontal[0] == key:
+			return self._horizontal[1]
+		self._horizontal = None
+		blurred_surface = _copy_surface(self._surface)
+		pixels = _get_np_pixels(blurred_surface)
+		for box_radius in radii:
+			_np_box_blur_pass(pixels, box_radius, 1)
+		blurred_surface.mark_dirty()
+		self._horizontal = (key, blurred_surface)
+		return blurred_surface
+
+	############################################################################
+################################################################################
+# BlurType.NP_BOX ##############################################################
+
+def _generic_np_box_blur(surface, radius, blur_direction):
+	"""Same box blur as BlurType.PX_BOX, but each pass is computed on all the
+	rows (or columns) at once by numpy, from the cumulative sums of the pixels
+	along the axis."""
+	return _np_separable_blur(surface, [radius], blur_direction)
+
+def _get_np_blur_radii(radius, blur_type):
+	"""Return the radii of the successive box blurs done in each direction by
+	the numpy blur type `blur_type`, for a blur of `radius`."""
+	if blur_type == BlurType.GAUSSIAN:
+		return [r for r in _get_gaussian_box_radii(radius, 3) if r > 0]
+	return [radius]
+
+def _np_separable_blur(surface, radii, blur_direction):
+	"""Blur a copy of `surface` with box blurs of each radius of `radii`,
+	first horizontally, then vertically."""
+	original = _copy_surface(surface)
+	pixels = _get_np_pixels(original)
+	if blur_direction != BlurDirection.VERTICAL:
+		for box_radius in radii:
+			_np_box_blur_pass(pixels, box_radius, 1)
+	if blur_direction != BlurDirection.HORIZONTAL:
+		for box_radius in radii:
+			_np_box_blur_pass(pixels, box_radius, 0)
+	original.mark_dirty()
+	return original
+
+def _get_np_pixels(surface):
+	"""Return an array of shape (height, width, 4) sharing the memory of the
+	ARGB32 `surface`, so the changes to the array are changes to the surface."""
+	return numpy.ndarray(shape=(surface.get_height(), surface.get_width(), 4), \
+	                  dtype=numpy.uint8, buffer=surface.get_data(), \
+	                  strides=(surface.get_stride(), 4, 1))
+
+# Minimal number of rows (or columns) in a band processed by a thread
+_BAND_MIN_SIZE = 64
+_band_executor = None
+
+def _np_box_blur_pass(pixels, radius, axis):
+	"""Replace each value of `pixels` by the average of the values at less
+	than `radius` along `axis`, where the edges are repeated, in place."""
+	if axis == 0:
+		job = lambda start, end: \
+		               _np_box_blur_band(pixels[:, start:end], radius, axis)
+	else:
+		job = lambda start, end: \
+		               _np_box_blur_band(pixels[start:end], radius, axis)
+	_run_on_bands(job, pixels.shape[1 - axis])
+
+def _run_on_bands(job, length):
+	"""Call `job(start, end)` for bands covering the range from 0 to `length`,
+	on several threads. The rows (or columns) of pixels are independent for a
+	pass along the other axis, and numpy releases the GIL during the
+	computations, so the bands of an array are processed at the same time."""
+	nb_bands = max(1, min(os.cpu_count() or 1, length // _BAND_MIN_SIZE))
+	if nb_bands == 1:
+		job(0, length)
+		return
+	executor = _get_band_executor()
+	futures = [executor.submit(job, length * i // nb_bands, \
+	                   length * (i + 1) // nb_bands) for i in range(0, nb_bands)]
+	for future in futures:
+		future.result() # waits, and raises what the thread may have raised
+
+def _get_band_executor():
+	global _band_executor
+	if _band_executor is None:
+		_band_executor = concurrent.futures.ThreadPoolExecutor( \
+		                      max_workers=os.cpu_count() or 1, \
+		                      thread_name_prefix='blur')
+	return _band_executor
+
+def _np_box_blur_band(pixels, radius, axis):
+	div = 2 * radius + 1
+	pad_width = [(0, 0)] * 3
+	pad_width[axis] = (radius + 1, radius)
+	padded = numpy.pad(pixels, pad_width, mode='edge')
+	# sums[i] = cumsum[i + div] - cumsum[i] is the sum of the `div` values
+	# centered on the i-th pixel. With 8 bits values, uint32 can't overflow.
+	cumsum = numpy.cumsum(padded, axis=axis, dtype=numpy.uint32)
+	if axis == 0:
+		sums = cumsum[div:] - cumsum[:-div]
+	else:
+		sums = cumsum[:, div:] - cumsum[:, :-div]
+	# rounded to the nearest value, so repeated passes don't darken the image
+	sums += radius
+	numpy.floor_divide(sums, div, out=sums)
+	pixels[...] = sums
+
+################################################################################
+# BlurType.GAUSSIAN ############################################################
+
+def _generic_gaussian_blur(surface, radius, blur_direction):
+	"""Approximation of a gaussian blur by 3 successive box blurs in each
+	direction. Averaging the channels of premultiplied ARGB32 pixels weights
+	the colors by their opacity, so semi-transparent areas blur correctly.
+	The box blurs are separable, so all the horizontal passes can be done
+	before the vertical ones."""
+	radii = _get_np_blur_radii(radius, BlurType.GAUSSIAN)
+	return _np_separable_blur(surface, radii, blur_direction)
+
+def _get_gaussian_box_radii(radius, nb_boxes):
+	"""Return the radii of `nb_boxes` box blurs which, applied successively,
+	approximate a gaussian with the same variance as one box blur of `radius`,
+	so the radius means roughly the same thing with any BlurType."""
+	# see "Fast Almost-Gaussian Filtering" (W. Jarosz, 2001): the variance of
+	# a box of width w is (w * w - 1) / 12, and the variances add up.
+	variance = radius * (radius + 1) / 3
+	ideal_width = math.sqrt(12 * variance / nb_boxes + 1)
+	lower_width = int(ideal_width)
+	if lower_width % 2 == 0:
+		lower_width -= 1
+	nb_lower = round((12 * variance - nb_boxes * lower_width * lower_width \
+	      - 4 * nb_boxes * lower_width - 3 * nb_boxes) / (-4 * lower_width - 4))
+	nb_lower = max(0, min(nb_boxes, nb_lower))
+	radii = []
+	for i in range(0, nb_boxes):
+		if i < nb_lower:
+			radii.append((lower_width - 1) // 2)
+		else:
+			radii.append((lower_width + 1) // 2)
+	return radii
+
 ################################################################################
 # BlurType.PX_BOX ##############################################################
 
@@ -60,8 +295,8 @@ def _generic_px_box_blur(surface, radius, blur_direction):
 		return surface
 
 	# this code a modified version of this https://github.com/elementary/granite/blob/14e3aaa216b61f7e63762214c0b36ee97fa7c52b/lib/Drawing/BufferSurface.vala#L230
-	# the main differences (aside of the language) is the poor attempt to use
-	# multithreading (i'm quite sure the access to buffers are not safe at all).
+	# It's single-threaded, and only used when numpy isn't available: the
+	# numpy blurs are the ones which run on several threads.
 	# The 2 phases of the algo have been separated to allow directional blur.
 	original = cairo.ImageSurface(cairo.Format.ARGB32, w, h)
 	cairo_context = cairo.Context(original)
@@ -161,104 +396,6 @@ def _box_blur_2nd_phase(w, h, channels, radius, pixels, buff0, vmin, vmax, dv):
 			bsum += buff0[p1 + 3] - buff0[p2 + 3]
 			cur_pixel += w * channels
 
-################################################################################
-# BlurType.PX_BOX_MULTI ########################################################
-
-def _generic_multi_threaded_blur(surface, radius, blur_direction):
-	"""Experimental multi-threaded blur. The parameter `blur_direction` will be
-	ignored (it always blurs in both directions)."""
-	w = surface.get_width()
-	h = surface.get_height()
-	channels = 4 # ARGB
-	if radius > w - 1 or radius > h - 1:
-		return
-
-	original = cairo.ImageSurface(cairo.Format.ARGB32, w, h)
-	cairo_context = cairo.Context(original)
-	# cairo_context.set_operator(cairo.Operator.SOURCE)
-	cairo_context.set_source_surface(surface, 0, 0)
-	cairo_context.paint()
-	original.flush()
-	pixels = original.get_data()
-
-	buffer0 = [None] * (w * h * channels)
-	vmin = [None] * max(w, h)
-	vmax = [None] * max(w, h)
-	div = 2 * radius + 1
-	dv = [None] * (256 * div)
-	for i in range(0, len(dv)):
-		dv[i] = int(i / div)
-
-	full_buff = _box_blur_1st_phase_multi(w, h, channels, radius, pixels, vmin, vmax, dv)
-	# print('end of the 1st phase…', datetime.now() - time0)
-	_box_blur_2nd_phase(w, h, channels, radius, pixels, full_buff, vmin, vmax, dv)
-
-	return original
-
-# this code a modified version of a naïve approach to box blur, copied from
-# here: https://github.com/elementary/granite/blob/14e3aaa216b61f7e63762214c0b36ee97fa7c52b/lib/Drawing/BufferSurface.vala#L230
-# the main differences (aside of the language) is the poor attempt to use
-# multithreading (i'm quite sure the access to buffers are not safe at all)
-# during the first phase. Multithreading of the second phase has not even been
-# tried because this multithreaded version is slower than _box_blur_1st_phase
-
-def _box_blur_1st_phase_multi(w, h, channels, radius, pixels, vmin, vmax, dv):
-	NB_THREADS = 4
-	t1 = [None] * NB_THREADS
-	full_buffer = []
-	buffers = []
-	y_end = 0
-	for x in range(0, w):
-		vmin[x] = min(x + radius + 1, w - 1)
-		vmax[x] = max(x - radius, 0)
-	for t in range(0, NB_THREADS):
-		y_start = y_end
-		if t == NB_THREADS - 1:
-			y_end = h
-		else:
-			y_end = y_start + int(h / NB_THREADS)
-		buff_size = w * (y_end - y_start) * channels
-		buff = [0] * buff_size
-		buffers.append(buff)
-		t1[t] = threading.Thread(target=_blur_rows3, args=(x, y_start, y_end, \
-		                     w, channels, radius, pixels, buff, vmin, vmax, dv))
-	for t in range(0, NB_THREADS):
-		t1[t].start()
-	for t in range(0, NB_THREADS):
-		t1[t].join()
-		full_buffer += buffers[t]
-	return full_buffer
-
-def _blur_rows3(x, y0, y1, w, channels, radius, pixels, buff0, vmin, vmax, dv):
-	# print('row thread with', y0, y1, '(begin)')
-	diff = y0 * w * channels
-	for y in range(y0, y1):
-		cur_pixel = y * w * channels
-		asum = radius * pixels[cur_pixel + 0]
-		rsum = radius * pixels[cur_pixel + 1]
-		gsum = radius * pixels[cur_pixel + 2]
-		bsum = radius * pixels[cur_pixel + 3]
-		for i in range(0, radius+1):
-			asum += pixels[cur_pixel + 0]
-			rsum += pixels[cur_pixel + 1]
-			gsum += pixels[cur_pixel + 2]
-			bsum += pixels[cur_pixel + 3]
-			cur_pixel += channels
-		cur_pixel = y * w * channels - diff
-		for x in range(0, w):
-			p1 = (y * w + vmin[x]) * channels
-			p2 = (y * w + vmax[x]) * channels
-			buff0[cur_pixel + 0] = dv[asum]
-			buff0[cur_pixel + 1] = dv[rsum]
-			buff0[cur_pixel + 2] = dv[gsum]
-			buff0[cur_pixel + 3] = dv[bsum]
-			asum += pixels[p1 + 0] - pixels[p2 + 0]
-			rsum += pixels[p1 + 1] - pixels[p2 + 1]
-			gsum += pixels[p1 + 2] - pixels[p2 + 2]
-			bsum += pixels[p1 + 3] - pixels[p2 + 3]
-			cur_pixel += channels
-	# print('row thread with', y0, y1, '(end)')
-
 ################################################################################
 # BlurType.CAIRO_REPAINTS ######################################################
 
@@ -313,7 +450,28 @@ def _generic_tiled_blur(surface, radius, blur_direction):
 	else:
 		tile_width = radius
 		tile_height = radius
-	return _get_tiled_surface(surface, tile_width, tile_height)
+	if numpy is None:
+		return _get_tiled_surface(surface, tile_width, tile_height)
+	return _get_np_tiled_surface(surface, tile_width, tile_height)
+
+def _get_np_tiled_surface(surface, tile_width, tile_height):
+	"""Fill each tile of `surface` with the average of its premultiplied
+	pixels, in place. The tiles on the right and bottom edges can be smaller."""
+	surface.flush()
+	pixels = _get_np_pixels(surface)
+	h, w = pixels.shape[0], pixels.shape[1]
+	row_starts = numpy.arange(0, h, tile_height)
+	column_starts = numpy.arange(0, w, tile_width)
+	sums = numpy.add.reduceat(pixels, row_starts, axis=0, dtype=numpy.uint32)
+	sums = numpy.add.reduceat(sums, column_starts, axis=1)
+	heights = numpy.diff(numpy.append(row_starts, h))
+	widths = numpy.diff(numpy.append(column_starts, w))
+	counts = numpy.outer(heights, widths)[:, :, numpy.newaxis]
+	averages = ((sums + counts // 2) // counts).astype(numpy.uint8)
+	averages = numpy.repeat(averages, heights, axis=0)
+	pixels[...] = numpy.repeat(averages, widths, axis=1)
+	surface.mark_dirty()
+	return surface
 
 def _get_tiled_surface(surface, tile_width, tile_height):
 	w = surface.get_width()
@@ -0,0 +1,179 @@
+# Licensed under GPL3 https://github.com/maoschanz/drawing/blob/master/LICENSE
+
+import cairo, json, struct, sys
+from gi.repository import Gdk, GdkPixbuf, GLib
+
+################################################################################
+# Conversion of operations to bytes ############################################
+
+# The only enumerations an operation can contain, identified by these names.
+# Nothing else than these types, and the types explicitly handled below, can
+# be read from the bytes, so reading a journal left in the cache can't run
+# anything.
+_ENUM_TYPES = {
+	'cairo.Antialias': cairo.Antialias,
+	'cairo.Extend': cairo.Extend,
+	'cairo.FillRule': cairo.FillRule,
+	'cairo.Filter': cairo.Filter,
+	'cairo.Format': cairo.Format,
+	'cairo.HintMetrics': cairo.HintMetrics,
+	'cairo.HintStyle': cairo.HintStyle,
+	'cairo.LineCap': cairo.LineCap,
+	'cairo.LineJoin': cairo.LineJoin,
+	'cairo.Operator': cairo.Operator,
+	'GdkPixbuf.InterpType': GdkPixbuf.InterpType,
+}
+_ENUM_NAMES = {enum_type: name for name, enum_type in _ENUM_TYPES.items()}
+
+def utilities_operation_to_bytes(operation):
+	"""Serialize an operation (or a state) of the history. Raises a TypeError
+	if a value of the operation can't be serialized.
+	The bytes are the length of a JSON document describing the operation, the
+	JSON document, then the binary data it refers to (such as the pixels of
+	the pixbufs), each preceded by its length."""
+	blobs = []
+	document = json.dumps(_encode_value(operation, blobs)).encode('utf-8')
+	chunks = [struct.pack('>I', len(document)), document]
+	for blob in blobs:
+		chunks.append(struct.pack('>Q', len(blob)))
+		chunks.append(blob)
+	return b''.join(chunks)
+
+def utilities_operation_from_bytes(data):
+	"""Read an operation serialized by `utilities_operation_to_bytes`. Raises
+	a ValueError if the bytes don't describe a valid operation."""
+	data = memoryview(data)
+	try:
+		length = struct.unpack_from('>I', data, 0)[0]
+		document = json.loads(bytes(data[4:4 + length]).decode('utf-8'))
+		blobs = []
+		offset = 4 + length
+		while offset < len(data):
+			blob_length = struct.unpack_from('>Q', data, offset)[0]
+			offset += 8
+			if offset + blob_length > len(data):
+				raise ValueError("Truncated data")
+			blobs.append(bytes(data[offset:offset + blob_length]))
+			offset += blob_length
+		return _decode_value(document, blobs)
+	except (struct.error, UnicodeDecodeError, KeyError, IndexError, \
+	                                                       TypeError) as e:
+		raise ValueError("Invalid operation data: " + str(e))
+
+def _encode_value(value, blobs):
+	if value is None or isinstance(value, (bool, float, str)):
+		return value
+	if isinstance(value, int):
+		if type(value) is int:
+			return value
+		# Enums from cairo or from GObject introspection
+		if type(value) not in _ENUM_NAMES:
+			raise TypeError("Can't serialize " + str(type(value)))
+		return {'__type__': 'enum', 'name': _ENUM_NAMES[type(value)], \
+		                                                  'value': int(value)}
+	if isinstance(value, bytes):
+		blobs.append(value)
+		return {'__type__': 'bytes', 'index': len(blobs) - 1}
+	if isinstance(value, list):
+		return [_encode_value(v, blobs) for v in value]
+	if isinstance(value, tuple):
+		return {'__type__': 'tuple', 'value': \
+		                                  [_encode_value(v, blobs) for v in value]}
+	if isinstance(value, dict):
+		for key in value.keys():
+			if not isinstance(key, str):
+				raise TypeError("Can't serialize the key " + str(key))
+		encoded = {k: _encode_value(v, blobs) for k, v in value.items()}
+		if '__type__' in value:
+			return {'__type__': 'dict', 'value': encoded}
+		return encoded
+	if isinstance(value, Gdk.RGBA):
+		return {'__type__': 'rgba', 'value': \
+		                 [value.red, value.green, value.blue, value.alpha]}
+	if isinstance(value, GdkPixbuf.Pixbuf):
+		blobs.append(value.read_pixel_bytes().get_data())
+		return {'__type__': 'pixbuf', 'width': value.get_width(), \
+		        'height': value.get_height(), 'rowstride': value.get_rowstride(), \
+		        'has_alpha': value.get_has_alpha(), 'pixels': len(blobs) - 1}
+	if isinstance(value, cairo.Path):
+		return {'__type__': 'path', 'value': \
+		                [[int(segment[0]), list(segment[1])] for segment in value]}
+	raise TypeError("Can't serialize " + str(type(value)))
+
+def _decode_value(value, blobs):
+	if isinstance(value, list):
+		return [_decode_value(v, blobs) for v in value]
+	if not isinstance(value, dict):
+		return value
+	value_type = value.get('__type__', None)
+	if value_type is None:
+		return {k: _decode_value(v, blobs) for k, v in value.items()}
+	elif value_type == 'dict':
+		return {k: _decode_value(v, blobs) for k, v in value['value'].items()}
+	elif value_type == 'tuple':
+		return tuple(_decode_value(v, blobs) for v in value['value'])
+	elif value_type == 'bytes':
+		return blobs[value['index']]
+	elif value_type == 'enum':
+		if value['name'] not in _ENUM_TYPES:
+			raise ValueError("Unknown enumeration " + str(value['name']))
+		return _ENUM_TYPES[value['name']](int(value['value']))
+	elif value_type == 'rgba':
+		r, g, b, a = [float(v) for v in value['value']]
+		return Gdk.RGBA(red=r, green=g, blue=b, alpha=a)
+	elif value_type == 'pixbuf':
+		return _build_pixbuf(value, blobs[value['pixels']])
+	elif value_type == 'path':
+		return _build_cairo_path(value['value'])
+	raise ValueError("Unknown type " + str(value_type))
+
+def _build_pixbuf(value, pixels):
+	width = int(value['width'])
+	height = int(value['height'])
+	rowstride = int(value['rowstride'])
+	has_alpha = bool(value['has_alpha'])
+	row_length = width * (4 if has_alpha else 3)
+	if width < 1 or height < 1 or rowstride < row_length \
+	or len(pixels) < rowstride * (height - 1) + row_length:
+		raise ValueError("Invalid pixbuf dimensions")
+	return GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(pixels), \
+	                             GdkPixbuf.Colorspace.RGB, has_alpha, 8, \
+	                                            width, height, rowstride)
+
+def _build_cairo_path(segments):
+	cairo_context = cairo.Context(cairo.ImageSurface(cairo.Format.ARGB32, 1, 1))
+	for segment_type, points in segments:
+		points = [float(p) for p in points]
+		if segment_type == cairo.PathDataType.MOVE_TO:
+			cairo_context.move_to(*points)
+		elif segment_type == cairo.PathDataType.LINE_TO:
+			cairo_context.line_to(*points)
+		elif segment_type == cairo.PathDataType.CURVE_TO:
+			cairo_context.curve_to(*points)
+		else: # if segment_type == cairo.PathDataType.CLOSE_PATH:
+			cairo_context.close_path()
+	return cairo_context.copy_path()
+
+################################################################################
+# Memory estimation ############################################################
+
+def utilities_get_operation_size(operation):
+	"""Estimate the number of bytes used by an operation (or a state) of the
+	history, including its pixbufs, paths, and lists of points."""
+	return _get_value_size(operation)
+
+def _get_value_size(value):
+	if isinstance(value, GdkPixbuf.Pixbuf):
+		return sys.getsizeof(value) + value.get_byte_length()
+	if isinstance(value, cairo.Path):
+		# a segment is a header and at most 3 points, each stored on 16 bytes
+		return sys.getsizeof(value) + sum(16 * (len(s[1]) // 2 + 1) \
+		                                                        for s in value)
+	size = sys.getsizeof(value)
+	if isinstance(value, (list, tuple)):
+		size += sum(_get_value_size(v) for v in value)
+	elif isinstance(value, dict):
+		size += sum(_get_value_size(v) for v in value.values())
+	return size
+
+################################################################################
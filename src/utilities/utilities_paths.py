@@ -209,4 +209,33 @@ def _next_arc(cairo_context, x1, y1, x2, y2, x3, y3, x4, y4):
 	return x1, y1, x2, y2, x3, y3, x4, y4
 
 ################################################################################
+# Path extents #################################################################
+
+def utilities_get_path_extents(cairo_path, margin, smooth=False):
+	"""Return the rectangle (x, y, width, height), in pixels, covering the path
+	and extended on each side by the margin."""
+	cairo_context = cairo.Context(cairo.ImageSurface(cairo.Format.ARGB32, 1, 1))
+	if smooth:
+		utilities_smooth_path(cairo_context, cairo_path)
+	else:
+		cairo_context.append_path(cairo_path)
+	x1, y1, x2, y2 = cairo_context.path_extents()
+	return _get_rectangle(x1, y1, x2, y2, margin)
+
+def utilities_get_points_extents(points, margin):
+	"""Same as `utilities_get_path_extents`, for a list of dicts with 'x' and
+	'y' values (it's how the brushes store their paths)."""
+	if len(points) == 0:
+		return None
+	all_x = [pt['x'] for pt in points]
+	all_y = [pt['y'] for pt in points]
+	return _get_rectangle(min(all_x), min(all_y), max(all_x), max(all_y), margin)
 
+def _get_rectangle(x1, y1, x2, y2, margin):
+	x = math.floor(x1 - margin)
+	y = math.floor(y1 - margin)
+	width = math.ceil(x2 + margin) - x
+	height = math.ceil(y2 + margin) - y
+	return (x, y, width, height)
+
+################################################################################
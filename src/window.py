@@ -16,11 +16,12 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 # Import libs
-import os
+import json, os
 from gi.repository import Gtk, Gdk, Gio, GdkPixbuf, GLib
 
 # Import various classes
 from .image import DrImage
+from .history_journal import DrHistoryJournal
 from .new_image_dialog import DrCustomImageDialog
 from .minimap import DrMinimap
 from .options_manager import DrOptionsManager
@@ -71,6 +72,8 @@ class DrWindow(Gtk.ApplicationWindow):
 		self._is_tools_initialisation_finished = False
 		self.devel_mode = False
 		self.should_track_framerate = False
+		self.should_profile_frames = False
+		self.frame_timings_log_path = None
 
 		if self.gsettings.get_boolean('maximized'):
 			self.maximize()
@@ -125,6 +128,10 @@ class DrWindow(Gtk.ApplicationWindow):
 		self.active_tool().select_flowbox_child()
 		self._is_tools_initialisation_finished = True
 
+		if len(self.app.get_windows()) == 1 \
+		and self.gsettings.get_boolean('history-journal'):
+			self._recover_journals()
+
 		self._try_show_release_notes()
 
 		# has to return False to be removed from the mainloop immediately
@@ -275,6 +282,48 @@ class DrWindow(Gtk.ApplicationWindow):
 		pixbuf = self.get_active_image().selection.get_pixbuf()
 		self._build_new_tab(pixbuf=pixbuf)
 
+	def _recover_journals(self):
+		"""Open the images whose journal has been left by a session which
+		didn't close them, most likely because of a crash. Their history is
+		restored from the journals."""
+		try:
+			orphans = DrHistoryJournal.get_orphans()
+		except OSError as e:
+			self.log_message(str(e))
+			return
+		recovered = 0
+		for journal in orphans:
+			if journal.get_metadata('closed'):
+				# Kept to be restored when the file is opened again
+				journal.close()
+				continue
+			file_path = journal.get_metadata('path')
+			try:
+				if file_path is None:
+					self._build_new_tab()
+					self.get_active_image().restore_history_from(journal)
+				else:
+					# The journal will be found when the file is loaded
+					journal.close()
+					self.build_new_from_file(Gio.File.new_for_path(file_path), \
+					                                                        False)
+				recovered += 1
+			except Exception as excp:
+				self.reveal_message(str(excp))
+				# Keep it for when the file is opened again, but unlock it so
+				# the other journals can still be recovered
+				self._release_journal(journal)
+		if recovered > 0:
+			# Context: an information message, %s is a number of images
+			self.reveal_message(_("%s image(s) recovered") % recovered, True)
+
+	def _release_journal(self, journal):
+		try:
+			journal.set_metadata(closed=True)
+		except OSError as e:
+			self.log_message(str(e))
+		journal.close()
+
 	def build_new_from_file(self, gfile, check_duplicates=True):
 		if check_duplicates:
 			w, duplicate = self.app.has_image_opened(gfile.get_path())
@@ -587,8 +636,14 @@ class DrWindow(Gtk.ApplicationWindow):
 		if self.devel_mode:
 			self.add_action_simple('restore_pixbuf', self.action_restore)
 			self.add_action_simple('rebuild_from_histo', self.action_rebuild)
+			self.add_action_simple('history_stats', self.action_history_stats)
+			self.add_action_simple('history_dump', self.action_history_dump)
 			self.add_action_simple('get_values', self.action_getvalues, ['<Ctrl>g'])
 			self.add_action_boolean('track_framerate', False, self.action_fsp)
+			self.add_action_boolean('profile_frames', False, \
+			                                        self.action_profile_frames)
+			self.add_action_boolean('log_frame_timings', False, \
+			                                     self.action_log_frame_timings)
 
 		action = Gio.PropertyAction.new('active_tab', self.notebook, 'page')
 		self.add_action(action)
@@ -1002,6 +1057,34 @@ class DrWindow(Gtk.ApplicationWindow):
 			img.reset_fps_counter()
 		args[0].set_state(GLib.Variant.new_boolean(self.should_track_framerate))
 
+	def action_profile_frames(self, *args):
+		"""Development only: measures the duration of each phase of the frames
+		(restoration of the surface, operation of the tool, painting, overlay,
+		outline), and displays their percentiles."""
+		self.should_profile_frames = not self.should_profile_frames
+		self._update_frame_profiling()
+		args[0].set_state(GLib.Variant.new_boolean(self.should_profile_frames))
+
+	def action_log_frame_timings(self, *args):
+		"""Development only: writes each duration measured by the frame
+		profiler in a file, in the cache directory."""
+		if self.frame_timings_log_path is None:
+			directory = os.path.join(GLib.get_user_cache_dir(), 'drawing')
+			os.makedirs(directory, exist_ok=True)
+			file_name = 'frames-' + GLib.DateTime.new_now_local().format('%F-%H%M%S')
+			self.frame_timings_log_path = os.path.join(directory, file_name + '.log')
+			self.reveal_message(self.frame_timings_log_path)
+		else:
+			self.frame_timings_log_path = None
+		self._update_frame_profiling()
+		is_logging = self.frame_timings_log_path is not None
+		args[0].set_state(GLib.Variant.new_boolean(is_logging))
+
+	def _update_frame_profiling(self):
+		for img in self.notebook.get_children():
+			img.set_frame_profiling(self.should_profile_frames, \
+			                                       self.frame_timings_log_path)
+
 	def get_active_image(self):
 		if self.pointer_to_current_page is None:
 			return self.notebook.get_nth_page(self.notebook.get_current_page())
@@ -1147,12 +1230,12 @@ class DrWindow(Gtk.ApplicationWindow):
 		return self.saving_manager.save_current_image(True, True, False, True)
 
 	def action_print(self, *args):
-		pixbuf = self.get_active_image().main_pixbuf
+		pixbuf = self.get_active_image().get_main_pixbuf()
 		self.printing_manager.print_pixbuf(pixbuf)
 
 	def action_export_cb(self, *args):
 		cb = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
-		cb.set_image(self.get_active_image().main_pixbuf)
+		cb.set_image(self.get_active_image().get_main_pixbuf())
 		self.reveal_message(_("Image copied to clipboard"), True)
 
 	############################################################################
@@ -1284,6 +1367,38 @@ class DrWindow(Gtk.ApplicationWindow):
 		"""[Dev only] rebuild the image according to the history content."""
 		self.get_active_image()._history._rebuild_from_history()
 
+	def action_history_stats(self, *args):
+		"""[Dev only] log the memory used, and the time taken to apply the
+		operations of the history, for each tool."""
+		stats = self.get_active_image().get_history_statistics()
+		megabyte = 1024 * 1024
+		self.log_message("{0:<20} {1:>6} {2:>11} {3:>11} {4:>10} {5:>9}".format( \
+		      "tool_id", "count", "memory", "spilled", "total", "max"))
+		tools = sorted(stats['tools'].items(), \
+		                       key=lambda item: item[1]['size'], reverse=True)
+		line = "{0:<20} {1:>6} {2:>8.2f} MB {3:>8.2f} MB {4:>7.1f} ms {5:>6.1f} ms"
+		for tool_id, summary in tools:
+			self.log_message(line.format(tool_id, summary['count'], \
+			     summary['size'] / megabyte, summary['spilled_size'] / megabyte, \
+			               summary['replay_cost'], summary['max_replay_cost']))
+		message = "{0:.2f} MB in memory, {1:.2f} MB in the spill file, {2:.1f} ms " + \
+		                                       "to replay since the last state"
+		self.reveal_message(message.format(stats['memory_usage'] / megabyte, \
+		                  stats['spill_file_size'] / megabyte, \
+		                                         stats['replay_cost']), True)
+
+	def action_history_dump(self, *args):
+		"""[Dev only] write the statistics of each entry of the history in a
+		JSON file, in the cache directory."""
+		stats = self.get_active_image().get_history_statistics()
+		directory = os.path.join(GLib.get_user_cache_dir(), 'drawing')
+		os.makedirs(directory, exist_ok=True)
+		file_name = 'history-' + GLib.DateTime.new_now_local().format('%F-%H%M%S')
+		file_path = os.path.join(directory, file_name + '.json')
+		with open(file_path, 'w') as json_file:
+			json.dump(stats, json_file, indent=1)
+		self.reveal_message(file_path)
+
 	def update_history_actions_labels(self, undo_label, redo_label):
 		self._decorations.set_undo_label(undo_label)
 		self._decorations.set_redo_label(redo_label)